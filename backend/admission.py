@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+from backend import metrics
+
+# --- ADMISSION CONTROL ---
+# Every LDAP-backed request takes a slot before it runs. Slots are limited globally and per
+# route; when none are free the request waits in a bounded priority queue (interactive before
+# bulk) until its deadline, after which it is shed with 503 + Retry-After instead of piling
+# more connections onto slapd. All state lives on the event loop, so no locking is needed.
+
+INTERACTIVE = 0
+BULK = 1
+
+ADMISSION_DECISIONS = metrics.Counter(
+    "admission_decisions_total", "Admission control outcomes by priority class.", ["priority", "outcome"])
+ADMISSION_QUEUE_DEPTH = metrics.Gauge(
+    "admission_queue_depth", "Requests waiting for an LDAP slot.")
+ADMISSION_IN_FLIGHT = metrics.Gauge(
+    "admission_in_flight", "Requests currently holding an LDAP slot.")
+ADMISSION_WAIT = metrics.Histogram(
+    "admission_wait_seconds", "Time spent queued before admission.", ["priority"])
+
+
+class Rejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and a Retry-After hint."""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency=16, max_queue=64, queue_timeout=5.0,
+                 route_limits=None, bulk_share=0.5, bulk_queue_share=0.25):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.route_limits = dict(route_limits or {})
+        # Bulk work may never occupy more than this many slots, so interactive routes always have headroom
+        self.bulk_limit = max(1, int(max_concurrency * bulk_share))
+        self.bulk_queue_limit = max(1, int(max_queue * bulk_queue_share))
+        self.in_flight = 0
+        self.bulk_in_flight = 0
+        self.route_in_flight = {}
+        self._queue = []  # heap of [priority, seq, route, future]
+        self._seq = itertools.count()
+        self._service_time = 0.1  # EWMA of slot hold time, for Retry-After estimates
+
+    def _can_run(self, route, priority):
+        if self.in_flight >= self.max_concurrency:
+            return False
+        if priority == BULK and self.bulk_in_flight >= self.bulk_limit:
+            return False
+        limit = self.route_limits.get(route)
+        return limit is None or self.route_in_flight.get(route, 0) < limit
+
+    def _take(self, route, priority):
+        self.in_flight += 1
+        if priority == BULK:
+            self.bulk_in_flight += 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _queued(self, priority=None):
+        return sum(1 for item in self._queue if priority is None or item[0] == priority)
+
+    def retry_after(self):
+        backlog = len(self._queue) + self.in_flight
+        return max(1, math.ceil(self._service_time * backlog / self.max_concurrency))
+
+    def _reject(self, priority, reason, status_code=503):
+        ADMISSION_DECISIONS.inc(priority=_label(priority), outcome=reason)
+        raise Rejected(status_code, reason, self.retry_after())
+
+    async def acquire(self, route, priority=INTERACTIVE):
+        # Fast path: nobody of equal or higher priority is waiting and a slot is free
+        if not any(item[0] <= priority for item in self._queue) and self._can_run(route, priority):
+            self._take(route, priority)
+            ADMISSION_DECISIONS.inc(priority=_label(priority), outcome="admitted")
+            return
+
+        if len(self._queue) >= self.max_queue:
+            self._reject(priority, "queue_full")
+        if priority == BULK and self._queued(BULK) >= self.bulk_queue_limit:
+            self._reject(priority, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        item = [priority, next(self._seq), route, future]
+        heapq.heappush(self._queue, item)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted in the same tick the deadline fired: keep the slot rather than leak it
+                pass
+            else:
+                future.cancel()
+                self._remove(item)
+                self._reject(priority, "timeout")
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if future.done() and not future.cancelled():
+                self.release(route, priority)
+            else:
+                future.cancel()
+                self._remove(item)
+            raise
+        ADMISSION_WAIT.observe(time.perf_counter() - start, priority=_label(priority))
+        ADMISSION_DECISIONS.inc(priority=_label(priority), outcome="admitted")
+
+    def _remove(self, item):
+        try:
+            self._queue.remove(item)
+            heapq.heapify(self._queue)
+        except ValueError:
+            pass
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+    def release(self, route, priority=INTERACTIVE, held_for=None):
+        self.in_flight -= 1
+        if priority == BULK:
+            self.bulk_in_flight -= 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 1) - 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        if held_for is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * held_for
+        self._wake()
+
+    def _wake(self):
+        # Walk waiters in priority order; skip ones blocked only by their own route limit so a
+        # saturated route can't head-of-line block the rest of the queue.
+        granted = []
+        for item in sorted(self._queue):
+            if self.in_flight >= self.max_concurrency:
+                break
+            priority, _, route, future = item
+            if future.done():
+                granted.append(item)
+                continue
+            if self._can_run(route, priority):
+                self._take(route, priority)
+                future.set_result(True)
+                granted.append(item)
+        if granted:
+            self._queue = [item for item in self._queue if item not in granted]
+            heapq.heapify(self._queue)
+            ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+
+class RateLimiter:
+    """Per-caller token bucket: `rate` requests/second with bursts of up to `burst`."""
+
+    def __init__(self, rate=20.0, burst=40, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def check(self, key):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            ADMISSION_DECISIONS.inc(priority="any", outcome="rate_limited")
+            raise Rejected(429, "rate_limited", max(1, math.ceil((1 - tokens) / self.rate)))
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now):
+        # A bucket that has had time to refill completely carries no state worth keeping
+        idle = self.burst / self.rate
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < idle}
+
+
+def _label(priority):
+    return "bulk" if priority == BULK else "interactive"
+
+
+def parse_route_limits(raw):
+    """Parses "/api/tree=2,/api/search/users=4" into {"/api/tree": 2, ...}."""
+    limits = {}
+    for part in (raw or "").split(","):
+        if "=" in part:
+            route, _, value = part.partition("=")
+            limits[route.strip()] = int(value)
+    return limits
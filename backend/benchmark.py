@@ -0,0 +1,420 @@
+"""
+Reproducible API benchmark against a local LDAP stand-in.
+
+Two modes:
+  * mock (default): seeds an in-process ldap3 MOCK_SYNC directory, starts the API with
+    uvicorn on a free local port and drives it over real HTTP.
+  * --url: drives an already running API (e.g. pointed at a throwaway local slapd).
+    Use --seed-ldap to populate that slapd first with the same synthetic data.
+
+Examples:
+  python -m backend.benchmark --users 10000 --concurrency 8
+  python -m backend.benchmark --users 100000 --groups 50 --max-group-members 200000 \\
+      --endpoints list_users,tree,login --requests 500
+  python -m backend.benchmark --compare bench_results/20260101-120000.json
+
+Results are written as JSON to bench_results/ so runs can be compared.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+
+BENCH_BASE_DN = "dc=crypto,dc=lake"
+BENCH_ADMIN = "admin"
+BENCH_ADMIN_PW = "bench-admin-pw"
+BENCH_USER_PW = "bench-user-pw"
+RESULTS_DIR = "bench_results"
+
+ENDPOINTS = {
+    # name: (method, path builder, needs admin token)
+    "list_users": ("GET", lambda ctx: "/api/users", False),
+    "list_users_walk": ("WALK", lambda ctx: "/api/users", False),
+    "list_groups": ("GET", lambda ctx: "/api/groups", False),
+    "get_user": ("GET", lambda ctx: f"/api/users/{ctx.random_user()}", False),
+    "search_users": ("GET", lambda ctx: f"/api/search/users?q={ctx.random_user()[:6]}", False),
+    "get_group": ("GET", lambda ctx: f"/api/groups/{ctx.random_group()}", False),
+    "group_members": ("GET", lambda ctx: f"/api/groups/{ctx.random_group()}/members", True),
+    "tree": ("GET", lambda ctx: "/api/tree", False),
+    "login": ("LOGIN", lambda ctx: "/api/login", False),
+}
+
+
+def user_name(i):
+    return f"user{i:07d}"
+
+
+def group_name(i):
+    return f"group{i:05d}"
+
+
+def group_sizes(num_groups, num_users, max_members):
+    """Group 0 is the big one; the rest fall off geometrically so sizes are realistic and deterministic."""
+    cap = min(max_members, num_users)
+    return [max(1, cap // (2 ** i)) for i in range(num_groups)]
+
+
+def iter_entries(num_users, num_groups, max_members, base_dn=BENCH_BASE_DN):
+    """Yields (dn, objectClasses, attributes) for the synthetic directory, parents first."""
+    admin_dn = f"cn={BENCH_ADMIN},{base_dn}"
+    users_ou = f"ou=users,{base_dn}"
+    groups_ou = f"ou=groups,{base_dn}"
+    yield base_dn, ['top', 'domain'], {'dc': base_dn.split(',')[0].split('=')[1]}
+    yield admin_dn, ['top', 'person'], {'cn': BENCH_ADMIN, 'sn': BENCH_ADMIN, 'userPassword': BENCH_ADMIN_PW}
+    yield users_ou, ['top', 'organizationalUnit'], {'ou': 'users'}
+    yield groups_ou, ['top', 'organizationalUnit'], {'ou': 'groups'}
+
+    for i in range(num_users):
+        uid = user_name(i)
+        yield f"uid={uid},{users_ou}", ['top', 'person', 'organizationalPerson', 'inetOrgPerson'], {
+            'uid': uid,
+            'cn': f"Bench User {i}",
+            'sn': f"User{i}",
+            'mail': f"{uid}@crypto.lake",
+            'title': random.choice(["Engineer", "Analyst", "Cryptographer", "Manager"]),
+            'userPassword': BENCH_USER_PW,
+        }
+
+    # Make the benchmark admin an actual admin: validate_admin matches on the ou=users DN form
+    yield f"cn=admins,{groups_ou}", ['top', 'groupOfNames'], {
+        'cn': 'admins',
+        'member': [admin_dn, f"uid={BENCH_ADMIN},{users_ou}"],
+    }
+    for g, size in enumerate(group_sizes(num_groups, num_users, max_members)):
+        members = [f"uid={user_name(i)},{users_ou}" for i in range(size)]
+        yield f"cn={group_name(g)},{groups_ou}", ['top', 'groupOfNames'], {
+            'cn': group_name(g),
+            'description': f"Bench group of {size}",
+            'member': members,
+        }
+
+
+class Context:
+    def __init__(self, args):
+        self.num_users = args.users
+        self.num_groups = args.groups
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+
+    def random_user(self):
+        with self.lock:
+            return user_name(self.rng.randrange(self.num_users))
+
+    def random_group(self):
+        with self.lock:
+            return group_name(self.rng.randrange(max(1, self.num_groups)))
+
+
+# --- STAND-IN DIRECTORY ---
+
+def seed_mock(args):
+    """Builds the MOCK_SYNC directory and rewires backend.main to use it."""
+    os.environ.setdefault("BASE_DN", BENCH_BASE_DN)
+    os.environ.setdefault("ADMIN_USER", BENCH_ADMIN)
+    os.environ.setdefault("ADMIN_PW", BENCH_ADMIN_PW)
+    # Every benchmark request comes from one client IP; the per-caller token bucket would turn
+    # most of them into 429s and the latencies into noise. Read by backend.main at import time.
+    os.environ.setdefault("RATE_LIMIT_PER_SECOND", "1000000")
+    os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+    # Jobs and the directory snapshot go under DATA_DIR; the synthetic directory must never
+    # land in the real data/ folder, where the next real start would restore it
+    data_dir = tempfile.mkdtemp(prefix="ldap-bench-")
+    atexit.register(shutil.rmtree, data_dir, ignore_errors=True)
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["DIRECTORY_SNAPSHOT"] = os.path.join(data_dir, "directory.snapshot")
+
+    from ldap3 import Server, MOCK_SYNC, OFFLINE_SLAPD_2_4
+    from backend import main
+
+    mock_server = Server("bench-mock", get_info=OFFLINE_SLAPD_2_4)
+
+    class MockConnection(main.InstrumentedConnection):
+        def __init__(self, server, *a, **kw):
+            kw["client_strategy"] = MOCK_SYNC
+            super().__init__(mock_server, *a, **kw)
+            # MOCK strategies skip auto_bind in __init__; do it so pooled connections arrive bound
+            if kw.get("auto_bind"):
+                self.open()
+                if not self.bind():
+                    from ldap3.core.exceptions import LDAPBindError
+                    raise LDAPBindError("mock bind failed")
+
+    main.InstrumentedConnection = MockConnection
+    main.get_ldap_server = lambda: mock_server
+
+    seeder = MockConnection(mock_server)
+    start = time.perf_counter()
+    count = 0
+    for dn, classes, attrs in iter_entries(args.users, args.groups, args.max_group_members, main.BASE_DN):
+        seeder.strategy.add_entry(dn, dict(attrs, objectClass=classes))
+        count += 1
+    print(f"Seeded {count} mock entries in {time.perf_counter() - start:.1f}s")
+    return main.app
+
+
+def seed_ldap(args):
+    """Populates a real (throwaway!) slapd using the backend's own LDAP settings."""
+    from ldap3 import Connection
+    from backend import main
+
+    start = time.perf_counter()
+    count = 0
+    with Connection(main.get_ldap_server(), user=main.ADMIN_DN, password=main.ADMIN_PW, auto_bind=True) as conn:
+        for dn, classes, attrs in iter_entries(args.users, args.groups, args.max_group_members, main.BASE_DN):
+            if dn == main.ADMIN_DN or dn == main.BASE_DN:
+                continue  # already present on any usable server
+            if not conn.add(dn, classes, attrs) and conn.result.get('description') != 'entryAlreadyExists':
+                raise SystemExit(f"Seeding failed at {dn}: {conn.result.get('description')}")
+            count += 1
+    print(f"Seeded {count} LDAP entries in {time.perf_counter() - start:.1f}s")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app):
+    import uvicorn
+
+    port = free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise SystemExit("uvicorn did not start")
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+# --- LOAD GENERATION ---
+
+def rss_mb(pid=None):
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_endpoint(name, base_url, ctx, args, admin_headers):
+    method, path_for, needs_admin = ENDPOINTS[name]
+    headers = admin_headers if needs_admin else {}
+    latencies = []
+    errors = 0
+    status_counts = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = httpx.Client(base_url=base_url, timeout=args.timeout)
+        return local.client
+
+    def one(_):
+        nonlocal errors
+        c = client()
+        start = time.perf_counter()
+        try:
+            if method == "LOGIN":
+                r = c.post(path_for(ctx), json={"username": ctx.random_user(), "password": BENCH_USER_PW})
+            elif method == "WALK":
+                # Full paged walk of the listing: the number a "scroll to the end" user feels
+                cookie = None
+                while True:
+                    params = {"page_size": args.page_size}
+                    if cookie:
+                        params["cookie"] = cookie
+                    r = c.get(path_for(ctx), params=params, headers=headers)
+                    cookie = r.json().get("next_cookie") if r.status_code == 200 else None
+                    if not cookie:
+                        break
+            else:
+                params = {"page_size": args.page_size} if name.startswith("list_") else None
+                r = c.get(path_for(ctx), params=params, headers=headers)
+            code = r.status_code
+        except httpx.HTTPError:
+            code = "exception"
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            status_counts[str(code)] = status_counts.get(str(code), 0) + 1
+            if code != 200:
+                errors += 1
+
+    total = args.requests if method != "WALK" else max(1, args.requests // 50)
+    for _ in range(min(args.warmup, total)):
+        one(None)
+    latencies.clear()
+    status_counts.clear()
+    errors = 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": total,
+        "errors": errors,
+        "status_counts": status_counts,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": ms(statistics.fmean(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nComparison against {previous_path} (rev {previous.get('git_revision')}):")
+    print(f"{'endpoint':<18}{'rps':>12}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, cur in current["endpoints"].items():
+        old = previous.get("endpoints", {}).get(name)
+        if not old:
+            continue
+
+        def delta(a, b):
+            if a is None or b in (None, 0):
+                return "n/a"
+            return f"{(a - b) / b * 100:+.1f}%"
+
+        print(f"{name:<18}{delta(cur['throughput_rps'], old['throughput_rps']):>12}"
+              f"{delta(cur['latency_ms']['p50'], old['latency_ms']['p50']):>12}"
+              f"{delta(cur['latency_ms']['p95'], old['latency_ms']['p95']):>12}"
+              f"{delta(cur['latency_ms']['p99'], old['latency_ms']['p99']):>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000, help="Number of synthetic users (10k/100k/1M)")
+    parser.add_argument("--groups", type=int, default=20, help="Number of synthetic groups")
+    parser.add_argument("--max-group-members", type=int, default=200_000, help="Size of the largest group")
+    parser.add_argument("--endpoints", default="list_users,list_groups,get_user,search_users,get_group,tree,login",
+                        help=f"Comma separated, from: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1, help="RNG seed for request targets")
+    parser.add_argument("--url", help="Benchmark a running API instead of the in-process mock")
+    parser.add_argument("--server-pid", type=int, help="With --url: PID of the API process to sample RSS from")
+    parser.add_argument("--seed-ldap", action="store_true", help="With --url: seed the configured LDAP server first")
+    parser.add_argument("--output", help="Result file (default: bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous result file to diff against")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    unknown = [n for n in names if n not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}")
+
+    random.seed(args.seed)
+    server = None
+    if args.url:
+        if args.seed_ldap:
+            seed_ldap(args)
+        base_url = args.url.rstrip("/")
+        server_pid = args.server_pid
+    else:
+        app = seed_mock(args)
+        server, base_url = start_server(app)
+        server_pid = os.getpid()
+
+    rss_before = rss_mb(server_pid) if server_pid else None
+    ctx = Context(args)
+
+    admin_headers = {}
+    if any(ENDPOINTS[n][2] for n in names):
+        r = httpx.post(f"{base_url}/api/login", json={"username": BENCH_ADMIN, "password": BENCH_ADMIN_PW},
+                       timeout=args.timeout)
+        r.raise_for_status()
+        admin_headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    results = {}
+    for name in names:
+        print(f"Running {name} ...", flush=True)
+        results[name] = run_endpoint(name, base_url, ctx, args, admin_headers)
+        lat = results[name]["latency_ms"]
+        print(f"  {results[name]['throughput_rps']} req/s  p50={lat['p50']}ms p95={lat['p95']}ms "
+              f"p99={lat['p99']}ms  errors={results[name]['errors']}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "mode": "url" if args.url else "mock",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "memory_mb": {
+            "server_rss_before": rss_before,
+            "server_rss_after": rss_mb(server_pid) if server_pid else None,
+            # ru_maxrss is KiB on Linux
+            "process_peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "endpoints": results,
+    }
+
+    if server:
+        server.should_exit = True
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nMemory (MB): {report['memory_mb']}")
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,680 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from ldap3 import BASE, SUBTREE
+
+from backend import metrics
+
+# --- COMPACT DIRECTORY MODEL ---
+# An in-memory mirror of users and groups sized for ~1M users / 50k groups in a few hundred MB.
+# Instead of one ldap3 Entry (or dict) per user, users are rows across column arrays:
+#   * string attributes live in one NUL-separated UTF-8 buffer per attribute (StringColumn),
+#     so a value costs its bytes plus a 4-byte offset;
+#   * DNs are an RDN column plus a parent pointer into a small table of interned container DNs;
+#   * lookups go through sorted hash arrays (HashIndex) rather than per-entry dict slots;
+#   * group membership is a sorted array('I') of user row ids, so set algebra runs in C
+#     (set/array operations) without materializing DN strings.
+# Rows are never reused; deleted users are flagged dead and dropped at the next full load.
+# Because the model is just flat buffers, a snapshot is those buffers written back to back
+# after a JSON header, and restoring it is one copy per buffer out of an mmap of the file.
+
+USER_ATTRS = ('uid', 'cn', 'sn', 'givenName', 'mail', 'displayName')
+USER_INT_ATTRS = ('uidNumber', 'gidNumber')
+GROUP_CLASSES = ('groupOfNames', 'groupOfUniqueNames', 'posixGroup')
+USER_FILTER = '(|(objectClass=person)(objectClass=posixAccount))'
+GROUP_FILTER = '(|' + "".join(f'(objectClass={c})' for c in GROUP_CLASSES) + ')'
+
+USER_SCAN_ATTRS = ['objectClass'] + list(USER_ATTRS + USER_INT_ATTRS)
+GROUP_SCAN_ATTRS = ['objectClass', 'cn', 'description', 'gidNumber', 'member', 'memberUid']
+
+SNAPSHOT_MAGIC = b"LDAPDIR1"
+SNAPSHOT_FORMAT = 2
+
+SEP = b"\x00"
+NO_VALUE = 0   # offset 0 is the buffer's leading separator, never a value start
+NO_INT = -1
+
+DIRECTORY_ENTRIES = metrics.Gauge(
+    "directory_model_entries", "Entries held by the in-memory directory model.", ["kind"])
+DIRECTORY_BYTES = metrics.Gauge(
+    "directory_model_bytes", "Approximate bytes held by the in-memory directory model.")
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def _is_group(attrs):
+    return any(c in (attrs.get('objectClass') or []) for c in GROUP_CLASSES)
+
+
+def _norm(dn):
+    return ",".join(part.strip() for part in dn.split(",")).lower()
+
+
+def _split_dn(dn):
+    rdn, _, parent = dn.partition(",")
+    return rdn.strip(), parent.strip()
+
+
+def _key_hash(key):
+    # Not hash(): str hashes are salted per process, and index arrays must survive a snapshot
+    return int.from_bytes(hashlib.blake2b(key.lower().encode("utf-8"), digest_size=8).digest(),
+                          "little", signed=True)
+
+
+def _paged(conn, base_dn, search_filter, attributes, page_size):
+    """Raw search results across all pages; no ldap3 Entry objects are built for a million rows."""
+    conn.search(base_dn, search_filter, search_scope=SUBTREE, attributes=attributes, paged_size=page_size)
+    while True:
+        for e in conn.response or []:
+            if e.get('type') == 'searchResEntry':
+                yield e
+        cookie = conn.result.get('controls', {}).get('1.2.840.113556.1.4.319', {}).get('value', {}).get('cookie')
+        if not cookie:
+            return
+        conn.search(base_dn, search_filter, search_scope=SUBTREE, attributes=attributes,
+                    paged_size=page_size, paged_cookie=cookie)
+
+
+class StringColumn:
+    """Append-only buffer of NUL-separated values; each row points at its current value."""
+
+    __slots__ = ("_buf", "_offsets", "_garbage")
+    BUFFERS = ("_buf", "_offsets")  # what a snapshot stores
+
+    def __init__(self):
+        self._buf = bytearray(SEP)
+        self._offsets = array('I')  # row -> start of its current value (NO_VALUE if none)
+        self._garbage = 0
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def set(self, row, value):
+        while len(self._offsets) <= row:
+            self._offsets.append(NO_VALUE)
+        old = self._offsets[row]
+        if old != NO_VALUE:
+            self._garbage += self._buf.index(SEP, old) - old + 1
+        if value is None or value == "":
+            self._offsets[row] = NO_VALUE
+            return
+        data = str(value).encode("utf-8").replace(SEP, b"")
+        start = len(self._buf)
+        self._buf += data
+        self._buf += SEP
+        self._offsets[row] = start
+
+    def get(self, row):
+        start = self._offsets[row] if row < len(self._offsets) else NO_VALUE
+        if start == NO_VALUE:
+            return None
+        return self._buf[start:self._buf.index(SEP, start)].decode("utf-8")
+
+    def nbytes(self):
+        return len(self._buf) + self._offsets.itemsize * len(self._offsets)
+
+    def garbage_ratio(self):
+        return self._garbage / max(1, len(self._buf))
+
+
+class HashIndex:
+    """key -> row via a sorted array of 64-bit string hashes (12 bytes/key, no per-key objects)."""
+
+    __slots__ = ("_hashes", "_rows", "_sorted")
+
+    def __init__(self):
+        self._hashes = array('q')
+        self._rows = array('I')
+        self._sorted = True
+
+    def add(self, key, row):
+        h = _key_hash(key)
+        if not self._sorted:
+            # Bulk load: append now, sort once on first lookup
+            self._hashes.append(h)
+            self._rows.append(row)
+            return
+        i = bisect_right(self._hashes, h)
+        self._hashes.insert(i, h)
+        self._rows.insert(i, row)
+
+    def bulk(self):
+        self._sorted = False
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        order = sorted(range(len(self._hashes)), key=self._hashes.__getitem__)
+        self._hashes = array('q', (self._hashes[i] for i in order))
+        self._rows = array('I', (self._rows[i] for i in order))
+        self._sorted = True
+
+    def candidates(self, key):
+        """Rows whose key hashes like `key`; callers verify (collisions are possible, if rare)."""
+        self._ensure_sorted()
+        h = _key_hash(key)
+        i = bisect_left(self._hashes, h)
+        while i < len(self._hashes) and self._hashes[i] == h:
+            yield self._rows[i]
+            i += 1
+
+    def remove(self, key, row):
+        self._ensure_sorted()
+        h = _key_hash(key)
+        i = bisect_left(self._hashes, h)
+        while i < len(self._hashes) and self._hashes[i] == h:
+            if self._rows[i] == row:
+                del self._hashes[i]
+                del self._rows[i]
+                return
+            i += 1
+
+    def nbytes(self):
+        return len(self._hashes) * (self._hashes.itemsize + self._rows.itemsize)
+
+
+class Group:
+    __slots__ = ("dn", "cn", "description", "gid", "posix", "members", "external")
+
+    def __init__(self, dn, cn, description=None, gid=None, posix=False):
+        self.dn = dn
+        self.cn = cn
+        self.description = description
+        self.gid = gid
+        self.posix = posix
+        self.members = array('I')  # sorted user rows
+        self.external = []         # member values that aren't users in the model
+
+
+class DirectoryStore:
+    def __init__(self, register_metrics=True):
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()  # one writer per snapshot file at a time
+        self._reset()
+        self._dirty = set()
+        self.loaded = False
+        self.loaded_at = None
+        self.version = 0  # bumped on every change; snapshot writers skip unchanged models
+        if register_metrics:
+            DIRECTORY_ENTRIES.set_function(lambda: self.user_count(), kind="user")
+            DIRECTORY_ENTRIES.set_function(lambda: len(self._groups), kind="group")
+            DIRECTORY_BYTES.set_function(lambda: self.nbytes())
+
+    def _reset(self):
+        self._containers = []       # interned parent DNs
+        self._container_ids = {}    # normalized parent DN -> id
+        self._parent = array('I')   # user row -> container id
+        self._rdn = StringColumn()
+        self._attrs = {name: StringColumn() for name in USER_ATTRS}
+        self._ints = {name: array('q') for name in USER_INT_ATTRS}
+        self._alive = bytearray()
+        self._dn_index = HashIndex()   # normalized user DN
+        self._uid_index = HashIndex()  # uid (memberUid resolution)
+        self._groups = {}              # normalized group DN -> Group
+        self._group_names = {}         # lowercased cn -> Group
+
+    # Everything _reset() creates; swapped wholesale when a fresh load completes
+    _MODEL_FIELDS = ("_containers", "_container_ids", "_parent", "_rdn", "_attrs", "_ints",
+                     "_alive", "_dn_index", "_uid_index", "_groups", "_group_names")
+
+    # --- DNs ---
+    def _container_id(self, parent_dn):
+        key = _norm(parent_dn)
+        cid = self._container_ids.get(key)
+        if cid is None:
+            cid = self._container_ids[key] = len(self._containers)
+            self._containers.append(parent_dn)
+        return cid
+
+    def user_dn(self, row):
+        return f"{self._rdn.get(row)},{self._containers[self._parent[row]]}"
+
+    def user_row(self, dn):
+        key = _norm(dn)
+        with self._lock:
+            for row in self._dn_index.candidates(key):
+                if self._alive[row] and _norm(self.user_dn(row)) == key:
+                    return row
+        return None
+
+    def user_row_by_uid(self, uid):
+        with self._lock:
+            for row in self._uid_index.candidates(uid):
+                if self._alive[row] and (self._attrs['uid'].get(row) or "").lower() == uid.lower():
+                    return row
+        return None
+
+    def _member_row(self, value):
+        """memberUid values are uids, member values are DNs."""
+        return self.user_row(value) if "=" in value else self.user_row_by_uid(value)
+
+    # --- writes ---
+    def put_user(self, dn, attrs, known_new=False):
+        with self._lock:
+            # known_new: bulk load of unique scan results, skip the lookup (and index sort)
+            row = None if known_new else self.user_row(dn)
+            if row is None:
+                row = len(self._alive)
+                rdn, parent = _split_dn(dn)
+                self._alive.append(1)
+                self._parent.append(self._container_id(parent))
+                self._rdn.set(row, rdn)
+                for name in USER_INT_ATTRS:
+                    self._ints[name].append(NO_INT)
+                self._dn_index.add(_norm(dn), row)
+            else:
+                old_uid = self._attrs['uid'].get(row)
+                if old_uid:
+                    self._uid_index.remove(old_uid, row)
+            for name in USER_ATTRS:
+                self._attrs[name].set(row, _first(attrs.get(name)))
+            for name in USER_INT_ATTRS:
+                value = _first(attrs.get(name))
+                try:
+                    self._ints[name][row] = int(value) if value not in (None, "") else NO_INT
+                except (TypeError, ValueError):
+                    self._ints[name][row] = NO_INT
+            uid = self._attrs['uid'].get(row)
+            if uid:
+                self._uid_index.add(uid, row)
+            self.version += 1
+            return row
+
+    def put_group(self, dn, attrs, members=(), member_uids=()):
+        classes = attrs.get('objectClass') or []
+        gid = _first(attrs.get('gidNumber'))
+        try:
+            gid = int(gid) if gid not in (None, "") else None
+        except (TypeError, ValueError):
+            print(f"Ignoring malformed gidNumber {gid!r} on {dn}")
+            gid = None
+        group = Group(
+            dn, _first(attrs.get('cn')), _first(attrs.get('description')),
+            gid=gid, posix='posixGroup' in classes,
+        )
+        rows = set()
+        with self._lock:
+            for value in list(members) + list(member_uids):
+                row = self._member_row(value)
+                if row is None:
+                    group.external.append(value)
+                else:
+                    rows.add(row)
+            group.members = array('I', sorted(rows))
+            self._set_group(_norm(dn), group)
+            self.version += 1
+        return group
+
+    def _set_group(self, key, group):
+        old = self._groups.get(key)
+        self._groups[key] = group
+        name = (group.cn or "").lower()
+        if old is not None and (old.cn or "").lower() != name:
+            self._unname_group(old)
+        if name:
+            self._group_names[name] = group
+
+    def _unname_group(self, group):
+        name = (group.cn or "").lower()
+        if self._group_names.get(name) is group:
+            # Another group may share the cn (different OU); it takes over the name
+            other = next((g for g in self._groups.values() if (g.cn or "").lower() == name and g is not group), None)
+            if other is None:
+                del self._group_names[name]
+            else:
+                self._group_names[name] = other
+
+    def remove(self, dn):
+        key = _norm(dn)
+        with self._lock:
+            group = self._groups.pop(key, None)
+            if group is not None:
+                self._unname_group(group)
+                self.version += 1
+                return True
+            row = self.user_row(dn)
+            if row is None:
+                return False
+            self._alive[row] = 0
+            self._dn_index.remove(key, row)
+            uid = self._attrs['uid'].get(row)
+            if uid:
+                self._uid_index.remove(uid, row)
+            for group in self._groups.values():
+                i = bisect_left(group.members, row)
+                if i < len(group.members) and group.members[i] == row:
+                    del group.members[i]
+            self.version += 1
+            return True
+
+    # --- reads ---
+    def user(self, row):
+        with self._lock:
+            item = {"dn": self.user_dn(row)}
+            for name in USER_ATTRS:
+                item[name] = self._attrs[name].get(row)
+            for name in USER_INT_ATTRS:
+                value = self._ints[name][row]
+                item[name] = None if value == NO_INT else value
+            return item
+
+    def user_count(self):
+        return self._alive.count(1)
+
+    def alive_rows(self):
+        with self._lock:
+            alive = self._alive
+            rows = array('I')
+            row = alive.find(1)
+            while row != -1:
+                rows.append(row)
+                row = alive.find(1, row + 1)
+            return rows
+
+    def group(self, name_or_dn):
+        with self._lock:
+            if "=" in name_or_dn:
+                return self._groups.get(_norm(name_or_dn))
+            return self._group_names.get(name_or_dn.lower())
+
+    def groups(self):
+        with self._lock:
+            return list(self._groups.values())
+
+    # --- set algebra over member rows (C-level set/array operations) ---
+    @staticmethod
+    def union(*row_sets):
+        result = set()
+        for rows in row_sets:
+            result.update(rows)
+        return array('I', sorted(result))
+
+    @staticmethod
+    def intersection(first, *others):
+        result = set(first)
+        for rows in sorted(others, key=len):
+            result.intersection_update(rows)
+            if not result:
+                break
+        return array('I', sorted(result))
+
+    @staticmethod
+    def difference(first, *others):
+        result = set(first)
+        for rows in others:
+            result.difference_update(rows)
+        return array('I', sorted(result))
+
+    # --- sync with LDAP ---
+    def mark_dirty(self, event):
+        """Change-feed listener: deletes apply at once, other changes are re-read on next sync()."""
+        if event.get("previous_dn"):
+            self.remove(event["previous_dn"])
+        if event.get("action") == "delete":
+            self.remove(event["dn"])
+        elif event.get("dn"):
+            with self._lock:
+                self._dirty.add(event["dn"])
+
+    def sync(self, conn):
+        """
+        Re-reads entries changed since the last sync. Users are applied before groups, so a
+        member added in the same batch resolves to its row instead of staying external. If a
+        read fails, whatever wasn't applied goes back into the dirty set for the next sync.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        done = set()
+        try:
+            found = []
+            for dn in dirty:
+                entry = self._read(conn, dn)
+                if entry is None:
+                    self.remove(dn)
+                    done.add(dn)
+                else:
+                    found.append((dn, entry))
+            found.sort(key=lambda f: _is_group(f[1][1]))
+            for dn, (entry_dn, attrs) in found:
+                self._apply(entry_dn, attrs)
+                done.add(dn)
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty - done
+            raise
+        return len(dirty)
+
+    def _read(self, conn, dn):
+        """(dn, attributes) of one entry, or None if it no longer exists."""
+        conn.search(dn, '(objectClass=*)', search_scope=BASE,
+                    attributes=['objectClass', 'member', 'memberUid', 'description'] + list(USER_ATTRS + USER_INT_ATTRS))
+        if not conn.entries:
+            return None
+        return conn.entries[0].entry_dn, conn.entries[0].entry_attributes_as_dict
+
+    def _apply(self, dn, attrs, known_new=False):
+        classes = attrs.get('objectClass') or []
+        if _is_group(attrs):
+            self.put_group(dn, attrs, attrs.get('member') or [], attrs.get('memberUid') or [])
+        elif 'person' in classes or 'inetOrgPerson' in classes or 'posixAccount' in classes:
+            self.put_user(dn, attrs, known_new)
+
+    def load(self, conn, base_dn, page_size=1000):
+        """Full paged scan into a fresh model: all users first (so memberships resolve), then groups."""
+        fresh = DirectoryStore(register_metrics=False)
+        fresh._dn_index.bulk()
+        fresh._uid_index.bulk()
+        fresh._scan(conn, base_dn, USER_FILTER, USER_SCAN_ATTRS, page_size)
+        fresh._dn_index._ensure_sorted()
+        fresh._uid_index._ensure_sorted()
+        fresh._scan(conn, base_dn, GROUP_FILTER, GROUP_SCAN_ATTRS, page_size)
+        self._install(fresh)
+
+    def catch_up(self, conn, base_dn, since, page_size=1000):
+        """Re-reads users, then groups, modified at or after `since` (generalized time)."""
+        changed = f'(modifyTimestamp>={since})'
+        count = self._scan(conn, base_dn, f'(&{changed}{USER_FILTER})', USER_SCAN_ATTRS, page_size, known_new=False)
+        count += self._scan(conn, base_dn, f'(&{changed}{GROUP_FILTER})', GROUP_SCAN_ATTRS, page_size, known_new=False)
+        return count
+
+    def reconcile(self, conn, base_dn, page_size=1000):
+        """Drops users and groups that no longer exist; catch_up() can't see deletes. DNs only."""
+        present = set()
+        for search_filter in (USER_FILTER, GROUP_FILTER):
+            for e in _paged(conn, base_dn, search_filter, ['1.1'], page_size):
+                present.add(_norm(e['dn']))
+        with self._lock:
+            gone = [g.dn for key, g in self._groups.items() if key not in present]
+            gone += [dn for dn in map(self.user_dn, self.alive_rows()) if _norm(dn) not in present]
+        for dn in gone:
+            self.remove(dn)
+        return len(gone)
+
+    def _scan(self, conn, base_dn, search_filter, attributes, page_size, known_new=True):
+        count = 0
+        for e in _paged(conn, base_dn, search_filter, attributes, page_size):
+            self._apply(e['dn'], e['attributes'], known_new=known_new)
+            count += 1
+        return count
+
+    def _install(self, fresh):
+        """Swaps in a freshly built model; changes noticed while it loaded stay dirty for sync()."""
+        with self._lock:
+            for name in self._MODEL_FIELDS:
+                setattr(self, name, getattr(fresh, name))
+            self.loaded = True
+            self.loaded_at = time.time()
+            self.version += 1
+
+    # --- snapshots ---
+    def _sections(self):
+        """Every flat buffer of the model, by name, in file order."""
+        sections = {"parent": self._parent, "alive": self._alive}
+        columns = [("rdn", self._rdn)] + [(f"attr.{name}", col) for name, col in self._attrs.items()]
+        for prefix, col in columns:
+            for field in StringColumn.BUFFERS:
+                sections[f"{prefix}.{field}"] = getattr(col, field)
+        for name, values in self._ints.items():
+            sections[f"int.{name}"] = values
+        for prefix, index in (("dn_index", self._dn_index), ("uid_index", self._uid_index)):
+            index._ensure_sorted()
+            sections[f"{prefix}._hashes"] = index._hashes
+            sections[f"{prefix}._rows"] = index._rows
+        return sections
+
+    def save_snapshot(self, path, meta=None):
+        """
+        Writes the model to `path` atomically (temp file, fsync, rename): magic, header length,
+        JSON header (layout, containers, group metadata, caller's `meta`), then raw buffers.
+        The buffers are copied under the lock and written outside it, so readers and writers
+        only wait for the copy, not the disk. Returns the file size.
+        """
+        with self._lock:
+            sections = self._sections()
+            layout, offset = {}, 0
+            for name, buf in sections.items():
+                size = len(buf) * getattr(buf, "itemsize", 1)
+                layout[name] = [getattr(buf, "typecode", "bytes"), offset, size]
+                offset += size
+            groups = []
+            for g in self._groups.values():
+                size = len(g.members) * g.members.itemsize
+                groups.append([g.dn, g.cn, g.description, g.gid, g.posix, list(g.external), offset, size])
+                offset += size
+            header = {
+                "format": SNAPSHOT_FORMAT,
+                "byteorder": sys.byteorder,
+                "itemsizes": {tc: array(tc).itemsize for tc in "Iq"},
+                "meta": meta or {},
+                "containers": list(self._containers),
+                "garbage": {prefix: col._garbage for prefix, col in
+                            [("rdn", self._rdn)] + [(f"attr.{n}", c) for n, c in self._attrs.items()]},
+                "sections": layout,
+                "groups": groups,
+                "data_bytes": offset,
+            }
+            chunks = [bytes(buf) for buf in sections.values()]
+            chunks += [bytes(g.members) for g in self._groups.values()]
+        header = json.dumps(header).encode("utf-8")
+        with self._snapshot_lock:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(len(header).to_bytes(8, "little"))
+                f.write(header)
+                for chunk in chunks:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        return len(SNAPSHOT_MAGIC) + 8 + len(header) + offset
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """
+        Builds a model from a snapshot file; returns (store, meta). The file is mmap'd and each
+        buffer is filled with a single copy of its slice. Raises ValueError if it is unusable.
+        """
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError("not a directory snapshot")
+            start = len(SNAPSHOT_MAGIC) + 8
+            header_len = int.from_bytes(mm[len(SNAPSHOT_MAGIC):start], "little")
+            header = json.loads(mm[start:start + header_len])
+            base = start + header_len
+            if header.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"unsupported snapshot format {header.get('format')}")
+            if header["byteorder"] != sys.byteorder or header["itemsizes"] != {tc: array(tc).itemsize for tc in "Iq"}:
+                raise ValueError("snapshot written on an incompatible platform")
+            if len(mm) != base + header["data_bytes"]:
+                raise ValueError("snapshot is truncated")
+
+            with memoryview(mm) as view:
+                def read(typecode, offset, size):
+                    chunk = view[base + offset:base + offset + size]
+                    if typecode == "bytes":
+                        return bytearray(chunk)
+                    values = array(typecode)
+                    values.frombytes(chunk)
+                    return values
+
+                store = cls(register_metrics=False)
+                sections = {name: read(*spec) for name, spec in header["sections"].items()}
+                store._parent = sections["parent"]
+                store._alive = sections["alive"]
+                columns = [("rdn", store._rdn)] + [(f"attr.{n}", c) for n, c in store._attrs.items()]
+                for prefix, col in columns:
+                    for field in StringColumn.BUFFERS:
+                        setattr(col, field, sections[f"{prefix}.{field}"])
+                    col._garbage = header["garbage"][prefix]
+                for name in store._ints:
+                    store._ints[name] = sections[f"int.{name}"]
+                for prefix, index in (("dn_index", store._dn_index), ("uid_index", store._uid_index)):
+                    index._hashes = sections[f"{prefix}._hashes"]
+                    index._rows = sections[f"{prefix}._rows"]
+                store._containers = header["containers"]
+                store._container_ids = {_norm(dn): i for i, dn in enumerate(store._containers)}
+                for dn, cn, description, gid, posix, external, offset, size in header["groups"]:
+                    group = Group(dn, cn, description, gid, posix)
+                    group.members = read("I", offset, size)
+                    group.external = external
+                    store._set_group(_norm(dn), group)
+        return store, header["meta"]
+
+    def restore(self, conn, base_dn, path, fingerprint=None, max_age=None, context_csn=None):
+        """
+        Installs the snapshot at `path` if it was taken of this directory (`fingerprint`) at
+        most `max_age` seconds ago, else raises ValueError. Entries modified since its
+        `synced_at` are re-read, then deletes are dropped with a DNs-only scan, skipped when
+        `context_csn` is unchanged since the snapshot. Returns the snapshot meta.
+        """
+        fresh, meta = DirectoryStore.from_snapshot(path)
+        if _norm(meta.get("base_dn") or "") != _norm(base_dn):
+            raise ValueError(f"snapshot is for {meta.get('base_dn')}, not {base_dn}")
+        if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+            raise ValueError(f"snapshot is of another directory ({meta.get('fingerprint')})")
+        age = time.time() - meta.get("saved_at", 0)
+        if max_age is not None and age > max_age:
+            raise ValueError(f"snapshot is {age:.0f}s old (max {max_age:.0f}s)")
+        meta["caught_up"] = fresh.catch_up(conn, base_dn, meta["synced_at"])
+        if context_csn is None or meta.get("context_csn") != context_csn:
+            meta["removed"] = fresh.reconcile(conn, base_dn)
+        self._install(fresh)
+        return meta
+
+    # --- introspection ---
+    def nbytes(self):
+        with self._lock:
+            total = self._rdn.nbytes() + sum(c.nbytes() for c in self._attrs.values())
+            total += sum(a.itemsize * len(a) for a in self._ints.values())
+            total += self._parent.itemsize * len(self._parent) + len(self._alive)
+            total += self._dn_index.nbytes() + self._uid_index.nbytes()
+            # Groups: member arrays plus a rough per-group object overhead
+            total += sum(g.members.itemsize * len(g.members) + 400 for g in self._groups.values())
+            return total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "loaded_at": self.loaded_at,
+                "users": self.user_count(),
+                "user_rows": len(self._alive),
+                "groups": len(self._groups),
+                "memberships": sum(len(g.members) for g in self._groups.values()),
+                "containers": len(self._containers),
+                "pending_changes": len(self._dirty),
+                "string_garbage_ratio": round(max(c.garbage_ratio() for c in self._attrs.values()), 3),
+                "approx_bytes": self.nbytes(),
+            }
@@ -0,0 +1,319 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from ldap3 import SUBTREE
+
+from backend import metrics
+
+# --- CHANGE FEED ---
+# Write routes and the directory listener publish change events here; every open
+# /api/events stream holds a Subscription with its own bounded queue. Publishing never
+# blocks: a subscriber that falls behind has its backlog replaced by a single "resync"
+# event (refetch everything) instead of slowing down writers or growing without bound.
+
+EVENTS_PUBLISHED = metrics.Counter(
+    "change_events_published_total", "Change events published by source, entry type and action.",
+    ["source", "type", "action"])
+EVENTS_DROPPED = metrics.Counter(
+    "change_events_dropped_total", "Change events discarded for subscribers that fell behind.")
+EVENT_SUBSCRIBERS = metrics.Gauge(
+    "change_event_subscribers", "Open change-feed subscriptions.")
+
+ACTIONS = ("add", "modify", "delete", "rename", "membership")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _norm_dn(dn):
+    return ",".join(part.strip() for part in dn.split(",")).lower()
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, loop, types=None, actions=None, base=None, max_queue=256):
+        self.loop = loop
+        self.types = set(types) if types else None
+        self.actions = set(actions) if actions else None
+        self.base = base.lower() if base else None
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._resync_pending = False
+
+    def matches(self, event):
+        if self.types and event["type"] not in self.types:
+            return False
+        if self.actions and event["action"] not in self.actions:
+            return False
+        if self.base:
+            dn = event["dn"].lower()
+            return dn == self.base or dn.endswith("," + self.base)
+        return True
+
+    def offer(self, event):
+        """Runs on the subscriber's event loop."""
+        if self._resync_pending:
+            # The client is going to refetch anyway; nothing queued after the resync matters
+            EVENTS_DROPPED.inc()
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            EVENTS_DROPPED.inc(dropped + 1)
+            self._resync_pending = True
+            self.queue.put_nowait({"id": None, "action": "resync", "type": None, "dn": None,
+                                   "source": "server", "time": _now(), "reason": "slow_consumer"})
+
+    async def next(self, timeout):
+        """Next event, or None if nothing happened within `timeout` seconds."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event["action"] == "resync":
+            self._resync_pending = False
+        return event
+
+
+class EventBus:
+    def __init__(self, classify=None, history=1000, max_queue=256, max_subscribers=500):
+        self.classify = classify or (lambda dn: "entry")
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listeners = []  # in-process consumers, called synchronously on publish
+        self._history = deque(maxlen=history)
+        self._seq = itertools.count(1)
+        self._own_writes = {}  # normalized dn -> deque of wall-clock times of our own writes
+        EVENT_SUBSCRIBERS.set_function(lambda: len(self._subscribers))
+
+    def publish(self, action, dn, source="api", **details):
+        event = {"action": action, "type": self.classify(dn), "dn": dn, "source": source,
+                 "time": _now(), **details}
+        with self._lock:
+            event["id"] = next(self._seq)
+            self._history.append(event)
+            if source == "api":
+                now = time.time()
+                self._own_writes.setdefault(_norm_dn(dn), deque(maxlen=16)).append(now)
+                if len(self._own_writes) > 10000:
+                    self._own_writes = {k: w for k, w in self._own_writes.items() if now - w[-1] < 60}
+            subscribers = [s for s in self._subscribers if s.matches(event)]
+        EVENTS_PUBLISHED.inc(source=source, type=event["type"], action=action)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Change listener callback error: {e}")
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # Loop already closed (shutdown); the stream is gone
+                self.unsubscribe(sub)
+        return event
+
+    def add_listener(self, fn):
+        """`fn(event)` runs in the publishing thread for every event; keep it cheap."""
+        self._listeners.append(fn)
+
+    def claim_own_write(self, dn, changed_at, window, skew):
+        """
+        True if the change to `dn` stamped `changed_at` (epoch seconds from the entry's
+        entryCSN/modifyTimestamp, None if unknown) is one this API wrote itself within `window`
+        seconds. Each recorded write matches at most one change, and only one stamped within
+        `skew` seconds of it, so an outside change to the same entry still comes through.
+        """
+        now = time.time()
+        key = _norm_dn(dn)
+        with self._lock:
+            writes = self._own_writes.get(key)
+            if not writes:
+                return False
+            while writes and now - writes[0] > window:
+                writes.popleft()
+            for written_at in writes:
+                if changed_at is None or abs(changed_at - written_at) <= skew:
+                    writes.remove(written_at)
+                    break
+            else:
+                return False
+            if not writes:
+                del self._own_writes[key]
+            return True
+
+    def subscribe(self, types=None, actions=None, base=None, last_event_id=None):
+        """Must be called on the event loop that will consume the subscription."""
+        sub = Subscription(asyncio.get_running_loop(), types, actions, base, self.max_queue)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(f"At most {self.max_subscribers} change-feed subscribers")
+            if last_event_id is not None:
+                oldest = self._history[0]["id"] if self._history else None
+                if oldest is not None and last_event_id + 1 < oldest:
+                    # The client missed events that are no longer buffered
+                    sub.offer({"id": None, "action": "resync", "type": None, "dn": None,
+                               "source": "server", "time": _now(), "reason": "history_expired"})
+                else:
+                    for event in self._history:
+                        if event["id"] > last_event_id and sub.matches(event):
+                            sub.offer(event)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+
+class ChangeListener:
+    """
+    Feeds changes made outside this API into the bus from a single background thread.
+
+    mode "psearch": a persistent search (389-DS, AD, ...) using an ASYNC_STREAM connection
+                    from `stream_factory`; sees adds, modifies, deletes and renames.
+    mode "poll":    one `modifyTimestamp>=last` search per interval on a pooled connection;
+                    works on OpenLDAP, but cannot observe deletes.
+    """
+
+    def __init__(self, bus, mode, base_dn, pool=None, stream_factory=None, interval=10.0,
+                 dedupe_window=30.0, clock_skew=2.0):
+        self.bus = bus
+        self.mode = mode
+        self.base_dn = base_dn
+        self.pool = pool
+        self.stream_factory = stream_factory
+        self.interval = interval
+        self.dedupe_window = dedupe_window
+        self.clock_skew = clock_skew  # modifyTimestamp has 1s resolution, plus server clock drift
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.mode not in ("psearch", "poll"):
+            return
+        self._thread = threading.Thread(target=self._run, name=f"change-listener-{self.mode}", daemon=True)
+        self._thread.start()
+        print(f"Change listener started ({self.mode})")
+
+    def stop(self):
+        self._stop.set()
+
+    def _emit(self, action, dn, changed_at=None, **details):
+        # Our own writes were already published by the route that made them
+        if self.bus.claim_own_write(dn, changed_at, self.dedupe_window, self.clock_skew):
+            return
+        self.bus.publish(action, dn, source="ldap", **details)
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                if self.mode == "psearch":
+                    self._run_psearch()
+                else:
+                    self._run_poll()
+                backoff = self.interval
+            except Exception as e:
+                print(f"Change listener error ({self.mode}): {e}")
+                backoff = min(backoff * 2, 300)
+                self._stop.wait(backoff)
+
+    def _run_psearch(self):
+        conn = self.stream_factory()
+        ps = conn.extend.standard.persistent_search(
+            search_base=self.base_dn, search_filter='(objectClass=*)', search_scope=SUBTREE,
+            attributes=['objectClass', 'modifyTimestamp'] + _csn_attr(conn), streaming=False,
+            changes_only=True, notifications=True)
+        try:
+            while not self._stop.is_set():
+                if conn.closed:
+                    raise ConnectionError("persistent search connection closed")
+                change = ps.next(block=True, timeout=1)
+                if not change or 'dn' not in change:
+                    continue
+                action = {"add": "add", "delete": "delete", "modify": "modify",
+                          "modify dn": "rename"}.get(change.get('changeType'), "modify")
+                details = {}
+                if change.get('previousDN') is not None:
+                    details["previous_dn"] = str(change['previousDN'])
+                self._emit(action, change['dn'], _change_time(change.get('attributes') or {}), **details)
+        finally:
+            try:
+                ps.stop()
+            except Exception:
+                pass
+
+    def _run_poll(self):
+        since = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%SZ')
+        seen = set()
+        while not self._stop.wait(self.interval):
+            with self.pool.lease() as conn:
+                conn.search(self.base_dn, f'(modifyTimestamp>={since})', search_scope=SUBTREE,
+                            attributes=['createTimestamp', 'modifyTimestamp'] + _csn_attr(conn))
+                entries = list(conn.entries)
+            newest = since
+            current = set()
+            for e in entries:
+                modified = _generalized_time(e, 'modifyTimestamp')
+                if modified is None:
+                    continue
+                key = (e.entry_dn, modified)
+                current.add(key)
+                newest = max(newest, modified)
+                if key in seen:
+                    continue
+                created = _generalized_time(e, 'createTimestamp')
+                self._emit("add" if created == modified else "modify", e.entry_dn,
+                           _change_time(e.entry_attributes_as_dict))
+            # `>=` re-returns entries stamped in the boundary second; remember them to skip next time
+            seen = {k for k in current if k[1] == newest}
+            since = newest
+
+
+def _generalized_time(entry, name):
+    if name not in entry or entry[name].value is None:
+        return None
+    value = entry[name].value
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).strftime('%Y%m%d%H%M%SZ')
+    return str(value)[:14] + 'Z'
+
+
+def _csn_attr(conn):
+    """['entryCSN'] where the server has it (OpenLDAP): microsecond change stamps."""
+    schema = conn.server.schema
+    return ['entryCSN'] if schema is None or 'entryCSN' in schema.attribute_types else []
+
+
+def _change_time(attributes):
+    """Epoch seconds of an entry's last change, from entryCSN or else modifyTimestamp."""
+    for name in ('entryCSN', 'modifyTimestamp'):
+        value = attributes.get(name)
+        if isinstance(value, (list, tuple)):
+            value = value[0] if value else None
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if value:
+            # entryCSN is "YYYYmmddHHMMSS.ffffffZ#count#sid#mod"; modifyTimestamp "YYYYmmddHHMMSSZ"
+            stamp = str(value).split('#', 1)[0].rstrip('Z')
+            try:
+                whole, _, fraction = stamp.partition('.')
+                at = datetime.strptime(whole[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+                return at.timestamp() + (float('0.' + fraction) if fraction.isdigit() else 0.0)
+            except ValueError:
+                continue
+    return None
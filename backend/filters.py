@@ -0,0 +1,170 @@
+from ldap3.utils.conv import escape_filter_chars
+
+from backend import metrics
+
+# --- FILTER CONSTRUCTION ---
+# Every user-supplied value goes through escape_filter_chars, so "*", "(" or "\" in a query
+# can't change the filter's meaning. The planner then picks the cheapest assertion each
+# attribute's index can answer: equality, then prefix (q*), and a contains (*q*) substring
+# only when a substring index exists and the value is long enough to use it. One unindexed
+# branch inside an OR makes slapd scan every entry, so unindexed attributes are left out.
+# Empty values are refused outright: "q*" / "*q*" with an empty q is a presence filter that
+# matches the whole directory.
+
+EQ, PREFIX, CONTAINS = "exact", "prefix", "contains"
+MODES = ("auto", EQ, PREFIX, CONTAINS)
+
+FILTER_PLANS = metrics.Counter(
+    "ldap_filter_plans_total", "Search filters built by the planner, by chosen match form.", ["form"])
+
+GROUP_CLASSES = ("groupOfNames", "groupOfUniqueNames", "posixGroup")
+
+
+def escape(value):
+    return escape_filter_chars(str(value))
+
+
+def eq(attr, value):
+    return f"({attr}={escape(value)})"
+
+
+def and_(*parts):
+    parts = [p for p in parts if p]
+    return parts[0] if len(parts) == 1 else "(&" + "".join(parts) + ")"
+
+
+def or_(*parts):
+    parts = [p for p in parts if p]
+    return parts[0] if len(parts) == 1 else "(|" + "".join(parts) + ")"
+
+
+def not_(part):
+    return f"(!{part})" if part else None
+
+
+def object_classes(*classes):
+    return or_(*(eq("objectClass", c) for c in classes))
+
+
+def is_group():
+    return object_classes(*GROUP_CLASSES)
+
+
+def parse_indexes(raw):
+    """
+    Parses slapd-style index lines separated by ";", e.g.
+    "objectClass eq; uid,cn,mail sub,eq; member,memberUid eq" -> {"uid": {"eq", "sub"}, ...}
+    """
+    indexes = {}
+    for line in (raw or "").split(";"):
+        parts = line.split()
+        if not parts:
+            continue
+        kinds = set(parts[1].split(",")) if len(parts) > 1 else {"eq"}
+        for attr in parts[0].split(","):
+            indexes.setdefault(attr.strip().lower(), set()).update(kinds)
+    return indexes
+
+
+class FilterPlanner:
+    def __init__(self, indexes, allow_substring=True, min_substring_length=3, min_prefix_length=2):
+        self.indexes = indexes
+        self.allow_substring = allow_substring
+        self.min_substring_length = min_substring_length
+        self.min_prefix_length = min_prefix_length
+
+    def check(self, value, mode="auto"):
+        """Raises ValueError for a value too short for `mode` (empty is too short for any)."""
+        if not value or not value.strip():
+            raise ValueError("Search value must not be empty")
+        minimum = {PREFIX: self.min_prefix_length, CONTAINS: self.min_substring_length}.get(mode, 1)
+        if len(value) < minimum:
+            raise ValueError(f"{mode} matches need at least {minimum} characters")
+
+    def _forms(self, attr):
+        kinds = self.indexes.get(attr.lower(), set())
+        forms = set()
+        if "eq" in kinds:
+            forms.add(EQ)
+        if kinds & {"sub", "subinitial"}:
+            forms.add(PREFIX)
+        if kinds & {"sub", "subany"}:
+            forms.add(CONTAINS)
+        return forms
+
+    def _assertion(self, attr, value, form):
+        value = escape(value)
+        if form == PREFIX:
+            return f"({attr}={value}*)"
+        if form == CONTAINS:
+            return f"({attr}=*{value}*)"
+        return f"({attr}={value})"
+
+    def _usable(self, attrs, schema):
+        if schema is None:
+            return list(attrs)
+        # The server rejects (or silently never matches) attribute types it doesn't know
+        return [a for a in attrs if a in schema.attribute_types]
+
+    def best_form(self, attr, value, mode="auto"):
+        """The cheapest form `mode` asks for that this attribute's indexes can serve."""
+        forms = self._forms(attr)
+        wanted = [EQ, PREFIX, CONTAINS] if mode == "auto" else [mode]
+        for form in wanted:
+            if form == CONTAINS and (not self.allow_substring or len(value) < self.min_substring_length):
+                continue
+            if form == PREFIX and len(value) < self.min_prefix_length:
+                continue
+            if form in forms:
+                return form
+        if mode == "auto" and forms:
+            return EQ
+        return None
+
+    def match(self, attrs, value, mode="auto", schema=None):
+        """
+        OR over `attrs` matching `value`, each attribute in its best indexed form.
+        An explicit mode is honoured even without an index (the caller asked for the scan).
+        Raises ValueError if `value` is too short for `mode` (see check()).
+        """
+        self.check(value, mode)
+        attrs = self._usable(attrs, schema)
+        parts = []
+        for attr in attrs:
+            form = self.best_form(attr, value, mode)
+            if form is None:
+                if mode == "auto":
+                    continue
+                form = mode
+            FILTER_PLANS.inc(form=form)
+            parts.append(self._assertion(attr, value, form))
+        if not parts and attrs:
+            # Nothing indexed: a scan is unavoidable, so at least keep it to a prefix match
+            print(f"No index covers {attrs}; searching unindexed")
+            FILTER_PLANS.inc(form="unindexed")
+            form = PREFIX if len(value) >= self.min_prefix_length else EQ
+            parts = [self._assertion(a, value, form) for a in attrs]
+        return or_(*parts)
+
+    def stages(self, attrs, value, schema=None):
+        """
+        Progressively broader filters for type-ahead search: prefix first and contains only
+        if the cheaper stage didn't fill the page. Duplicate stages are collapsed.
+        Raises ValueError for an empty value.
+        """
+        self.check(value)
+        result = []
+        for mode in (PREFIX, CONTAINS):
+            attrs_for_mode = [a for a in self._usable(attrs, schema) if self.best_form(a, value, mode)]
+            if mode == PREFIX:
+                # Attributes with only an equality index still take part, as exact matches
+                attrs_for_mode += [a for a in self._usable(attrs, schema)
+                                   if a not in attrs_for_mode and self.best_form(a, value, EQ)]
+            if not attrs_for_mode:
+                continue
+            f = or_(*(self._assertion(a, value, self.best_form(a, value, mode) or EQ) for a in attrs_for_mode))
+            if f not in result:
+                result.append(f)
+        if not result:
+            result.append(self.match(attrs, value, schema=schema))
+        return result
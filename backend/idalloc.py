@@ -0,0 +1,113 @@
+import threading
+
+from ldap3 import BASE, SUBTREE, MODIFY_ADD, MODIFY_DELETE
+
+from backend import metrics
+
+# --- uidNumber / gidNumber ALLOCATION ---
+# The next free ID lives in a counter entry in the directory. A process reserves a whole block
+# with a single compare-and-swap modify (delete the old value + add the new one in one atomic
+# MODIFY; if another writer moved the counter first the delete fails with noSuchAttribute and
+# we re-read and retry). IDs inside the block are then handed out from memory.
+#
+# IDs left in a block when the process exits are simply skipped; uniqueness, not density, is
+# what POSIX needs.
+
+ID_BLOCKS_RESERVED = metrics.Counter(
+    "id_blocks_reserved_total", "ID blocks reserved from the directory counter.", ["kind"])
+ID_CAS_CONFLICTS = metrics.Counter(
+    "id_counter_conflicts_total", "Compare-and-swap retries on the ID counter entry.", ["kind"])
+
+
+class IdAllocationError(Exception):
+    pass
+
+
+class IdAllocator:
+    """
+    Hands out unique POSIX IDs of one kind ('uidNumber' or 'gidNumber').
+
+    The counter entry is a core-schema `device` whose serialNumber holds the next unreserved
+    ID, so it never shows up in group or user listings.
+    """
+
+    def __init__(self, kind, counter_dn, base_dn, range_start=10000, block_size=100, max_retries=20):
+        self.kind = kind
+        self.counter_dn = counter_dn
+        self.base_dn = base_dn
+        self.range_start = range_start
+        self.block_size = block_size
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0  # exclusive
+
+    def allocate(self, conn):
+        """Returns the next free ID; touches LDAP only when the current block is used up."""
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block(conn)
+            value = self._next
+            self._next += 1
+            return value
+
+    def available(self):
+        with self._lock:
+            return self._end - self._next
+
+    def _reserve_block(self, conn):
+        for _ in range(self.max_retries):
+            current = self._read_counter(conn)
+            if current is None:
+                self._create_counter(conn)
+                continue
+            new_value = current + self.block_size
+            changes = {'serialNumber': [(MODIFY_DELETE, [str(current)]), (MODIFY_ADD, [str(new_value)])]}
+            if conn.modify(self.counter_dn, changes):
+                ID_BLOCKS_RESERVED.inc(kind=self.kind)
+                return current, new_value
+            if conn.result.get('description') not in ('noSuchAttribute', 'attributeOrValueExists'):
+                raise IdAllocationError(f"Reserving {self.kind} block failed: {conn.result.get('description')}")
+            # Another process reserved a block between our read and write
+            ID_CAS_CONFLICTS.inc(kind=self.kind)
+        raise IdAllocationError(f"Could not reserve a {self.kind} block after {self.max_retries} attempts")
+
+    def _read_counter(self, conn):
+        conn.search(self.counter_dn, '(objectClass=*)', search_scope=BASE, attributes=['serialNumber'])
+        if not conn.entries:
+            return None
+        return int(conn.entries[0].serialNumber.value)
+
+    def _create_counter(self, conn):
+        """First use only: seed the counter above every ID already in the directory."""
+        start = max(self.range_start, self._highest_existing(conn) + 1)
+        parent_dn = self.counter_dn.split(',', 1)[1]
+        conn.search(parent_dn, '(objectClass=*)', search_scope=BASE)
+        if not conn.entries:
+            ou = parent_dn.split(',', 1)[0].split('=', 1)[1]
+            conn.add(parent_dn, ['top', 'organizationalUnit'], {'ou': ou})
+        cn = self.counter_dn.split(',', 1)[0].split('=', 1)[1]
+        attrs = {'cn': cn, 'serialNumber': str(start), 'description': f"Next free {self.kind} (managed by the API)"}
+        if not conn.add(self.counter_dn, ['top', 'device'], attrs):
+            # Lost the race to another process: fine, its counter is just as good
+            if conn.result.get('description') != 'entryAlreadyExists':
+                raise IdAllocationError(f"Creating {self.kind} counter failed: {conn.result.get('description')}")
+        print(f"Initialized {self.kind} counter at {start}")
+
+    def _highest_existing(self, conn):
+        conn.search(self.base_dn, f'({self.kind}>={self.range_start})', search_scope=SUBTREE,
+                    attributes=[self.kind], paged_size=1000)
+        highest = 0
+        while True:
+            for e in conn.entries:
+                if self.kind not in e:
+                    continue
+                try:
+                    highest = max(highest, int(e[self.kind].value))
+                except (TypeError, ValueError):
+                    pass
+            cookie = conn.result.get('controls', {}).get('1.2.840.113556.1.4.319', {}).get('value', {}).get('cookie')
+            if not cookie:
+                return highest
+            conn.search(self.base_dn, f'({self.kind}>={self.range_start})', search_scope=SUBTREE,
+                        attributes=[self.kind], paged_size=1000, paged_cookie=cookie)
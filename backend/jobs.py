@@ -0,0 +1,347 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import HTTPException
+from ldap3.core.exceptions import LDAPException
+
+from backend import metrics
+
+# --- BACKGROUND JOBS ---
+# Bulk operations run as jobs: the caller submits a list of items, gets a job id back at once,
+# and a small pool of worker threads works through the items on leased pool connections at a
+# throttled rate. Each job's item list is written once to its own file and failures are appended
+# to another; progress (cursor, counters, the first few failures) is checkpointed to a small JSON
+# file per job, so a restart resumes each job from its cursor instead of starting over.
+
+JOB_ITEMS = metrics.Counter(
+    "job_items_processed_total", "Items processed by background jobs.", ["kind", "result"])
+JOBS_ACTIVE = metrics.Gauge(
+    "jobs_active", "Background jobs queued or running.")
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED, INTERRUPTED = (
+    "queued", "running", "completed", "failed", "cancelled", "interrupted")
+FINISHED = {COMPLETED, FAILED, CANCELLED, INTERRUPTED}
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobKind:
+    """
+    `run(conn, item)` processes one item and raises HTTPException on a per-item failure.
+    `expand(conn, params)` (optional) computes the item list when the job starts.
+    `secret` names an item field that must never be written to disk.
+    `validate(params)` (optional) rejects bad parameters at submit time with HTTPException.
+    """
+
+    def __init__(self, run, expand=None, secret=None, validate=None):
+        self.run = run
+        self.expand = expand
+        self.secret = secret
+        self.validate = validate
+
+
+class JobManager:
+    def __init__(self, lease, kinds, store_dir, workers=2, rate=50.0, chunk_size=100,
+                 max_items=100000, retention_hours=72, checkpoint_every=1.0, failures_kept=100):
+        self.lease = lease  # () -> context manager yielding a connection
+        self.kinds = kinds
+        self.store_dir = store_dir
+        self.workers = workers
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.max_items = max_items
+        self.retention = retention_hours * 3600
+        self.checkpoint_every = checkpoint_every
+        self.failures_kept = failures_kept  # failures kept in the checkpoint; all go to the log
+        self._jobs = {}
+        self._secrets = {}  # job id -> {index: secret value}, memory only
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        JOBS_ACTIVE.set_function(
+            lambda: sum(1 for j in list(self._jobs.values()) if j["status"] not in FINISHED))
+
+    # --- lifecycle ---
+    def start(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._load()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _load(self):
+        cutoff = time.time() - self.retention
+        for name in sorted(os.listdir(self.store_dir)):
+            if not name.endswith(".json") or name.endswith(".items.json"):
+                continue
+            path = os.path.join(self.store_dir, name)
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable job file {name}: {e}")
+                continue
+            if job.get("kind") not in self.kinds:
+                print(f"Skipping job file {name}: unknown job kind {job.get('kind')!r}")
+                continue
+            if job["status"] in FINISHED and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                self._remove_items(job)
+                self._remove(self._failures_path(job))
+                continue
+            items = job.pop("items", None)  # files from before items were stored separately
+            job["items"] = []
+            self._jobs[job["id"]] = job
+            if job["status"] in FINISHED:
+                continue
+            if items is None:
+                try:
+                    items = self._load_items(job)
+                except (OSError, ValueError) as e:
+                    if not (self.kinds[job["kind"]].expand and job["cursor"] == 0):
+                        print(f"Job {job['id']} has no readable item list: {e}")
+                        self._finish(job, FAILED, "Item list lost; resubmit the job")
+                        continue
+                    items = []  # not expanded yet; the worker expands it again
+            job["items"] = items
+            if self.kinds[job["kind"]].secret:
+                # Secrets were never persisted, so the remaining items can't be replayed
+                self._finish(job, INTERRUPTED, f"Restarted at item {job['cursor']}; resubmit the remaining items")
+                continue
+            job["status"] = QUEUED
+            self._queue.put(job["id"])
+            print(f"Resuming job {job['id']} ({job['kind']}) at item {job['cursor']}/{job['total']}")
+
+    # --- API ---
+    def submit(self, kind, items=None, params=None, created_by=None):
+        if kind not in self.kinds:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind; supported: {', '.join(self.kinds)}")
+        spec = self.kinds[kind]
+        if spec.validate:
+            spec.validate(params or {})
+        items = list(items or [])
+        if not items and not spec.expand:
+            raise HTTPException(status_code=400, detail="No items to process")
+        if len(items) > self.max_items:
+            raise HTTPException(status_code=400, detail=f"At most {self.max_items} items per job")
+
+        job_id = uuid.uuid4().hex
+        secrets = {}
+        if spec.secret:
+            for i, item in enumerate(items):
+                if not isinstance(item, dict) or spec.secret not in item:
+                    raise HTTPException(status_code=400, detail=f"Item {i} is missing '{spec.secret}'")
+                secrets[i] = item[spec.secret]
+                items[i] = {k: v for k, v in item.items() if k != spec.secret}
+
+        job = {
+            "id": job_id, "kind": kind, "status": QUEUED, "params": params or {},
+            "created_by": created_by, "created_at": _now(), "started_at": None, "finished_at": None,
+            "items": items, "total": len(items), "cursor": 0, "succeeded": 0, "failed": 0,
+            "failures": [], "cancel_requested": False, "error": None,
+        }
+        self._save_items(job)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._secrets[job_id] = secrets
+            self._save(job)
+        self._queue.put(job_id)
+        return self.describe(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    def list(self):
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j["created_at"], reverse=True)
+            return [self.describe(j) for j in jobs]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        with self._lock:
+            if job["status"] in FINISHED:
+                raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+            job["cancel_requested"] = True
+            if job["status"] == QUEUED:
+                self._finish(job, CANCELLED)
+        return self.describe(job)
+
+    @staticmethod
+    def describe(job, failures_limit=100):
+        """Public view of a job: progress counters and the first failures, not the item list."""
+        view = {k: v for k, v in job.items() if k not in ("items", "failures")}
+        view["processed"] = job["cursor"]
+        view["failures"] = job["failures"][:failures_limit]
+        view["failures_truncated"] = job["failed"] > len(view["failures"])
+        return view
+
+    def failures(self, job_id, offset=0, limit=1000):
+        """Every recorded failure of a job, from its append-only log."""
+        job = self.get(job_id)
+        result = []
+        try:
+            with open(self._failures_path(job)) as f:
+                for i, line in enumerate(f):
+                    if i >= offset + limit:
+                        break
+                    if i >= offset:
+                        result.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return {"id": job_id, "failed": job["failed"], "offset": offset, "failures": result}
+
+    # --- persistence ---
+    def _write(self, path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _items_path(self, job):
+        return os.path.join(self.store_dir, f"{job['id']}.items.json")
+
+    def _save(self, job):
+        """Checkpoint status, cursor and counters; the item list is written once by `_save_items`."""
+        self._write(os.path.join(self.store_dir, f"{job['id']}.json"),
+                    {k: v for k, v in job.items() if k != "items"})
+
+    def _save_items(self, job):
+        self._write(self._items_path(job), job["items"])
+
+    def _load_items(self, job):
+        with open(self._items_path(job)) as f:
+            return json.load(f)
+
+    def _remove_items(self, job):
+        self._remove(self._items_path(job))
+
+    def _failures_path(self, job):
+        return os.path.join(self.store_dir, f"{job['id']}.failures.jsonl")
+
+    def _record_failure(self, job, failure):
+        """Appends to the job's failure log; only the first `failures_kept` ride in checkpoints."""
+        with open(self._failures_path(job), "a") as f:
+            f.write(json.dumps(failure) + "\n")
+        if len(job["failures"]) < self.failures_kept:
+            job["failures"].append(failure)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _finish(self, job, status, error=None):
+        job["status"] = status
+        job["error"] = error
+        job["finished_at"] = _now()
+        job["items"] = []  # failures keep their own copy of the items that matter
+        self._secrets.pop(job["id"], None)
+        self._save(job)
+        self._remove_items(job)
+
+    # --- workers ---
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                print(f"Job {job_id} crashed: {e}")
+                with self._lock:
+                    self._finish(job, FAILED, str(e))
+
+    def _run(self, job):
+        spec = self.kinds[job["kind"]]
+        with self._lock:
+            job["status"] = RUNNING
+            job["started_at"] = job["started_at"] or _now()
+            self._save(job)
+
+        if spec.expand and not job["items"]:
+            with self.lease() as conn:
+                items = spec.expand(conn, job["params"])
+            if len(items) > self.max_items:
+                with self._lock:
+                    self._finish(job, FAILED, f"Expanded to {len(items)} items; at most {self.max_items} per job")
+                return
+            job["items"] = items
+            job["total"] = len(items)
+            self._save_items(job)
+            with self._lock:
+                self._save(job)
+
+        secrets = self._secrets.get(job["id"], {})
+        interval = 1.0 / self.rate if self.rate > 0 else 0
+        last_checkpoint = time.monotonic()
+        ldap_errors = 0
+        while job["cursor"] < job["total"]:
+            if job["cancel_requested"]:
+                with self._lock:
+                    self._finish(job, CANCELLED)
+                return
+            try:
+                # Lease per chunk, not per job, so a long job never starves interactive requests
+                with self.lease() as conn:
+                    end = min(job["cursor"] + self.chunk_size, job["total"])
+                    while job["cursor"] < end and not job["cancel_requested"]:
+                        started = time.monotonic()
+                        index = job["cursor"]
+                        item = job["items"][index]
+                        if index in secrets:
+                            item = {**item, spec.secret: secrets[index]}
+                        try:
+                            spec.run(conn, item)
+                            job["succeeded"] += 1
+                            JOB_ITEMS.inc(kind=job["kind"], result="ok")
+                        except HTTPException as e:
+                            job["failed"] += 1
+                            self._record_failure(job, {"index": index, "item": job["items"][index],
+                                                       "status_code": e.status_code, "detail": e.detail})
+                            JOB_ITEMS.inc(kind=job["kind"], result="error")
+                        job["cursor"] += 1
+                        ldap_errors = 0
+
+                        if time.monotonic() - last_checkpoint >= self.checkpoint_every:
+                            with self._lock:
+                                self._save(job)
+                            last_checkpoint = time.monotonic()
+                        # Throttle: at most `rate` items/second per job
+                        remaining = interval - (time.monotonic() - started)
+                        if remaining > 0:
+                            time.sleep(remaining)
+            except LDAPException as e:
+                # Connection-level failure: the lease discards the connection; retry the same
+                # item on a fresh one, giving up after a few consecutive failures
+                ldap_errors += 1
+                JOB_ITEMS.inc(kind=job["kind"], result="ldap_error")
+                print(f"Job {job['id']} LDAP Error at item {job['cursor']} (attempt {ldap_errors}): {e}")
+                if ldap_errors >= 3:
+                    with self._lock:
+                        self._finish(job, FAILED, f"LDAP Error at item {job['cursor']}: {e}")
+                    return
+                time.sleep(2 ** ldap_errors)
+
+        with self._lock:
+            self._finish(job, CANCELLED if job["cancel_requested"] else COMPLETED)
@@ -1,17 +1,37 @@
 from http import server
 import os
+import asyncio
+import threading
 import base64
 import ssl
 import time
 import jwt
 from jwt.exceptions import InvalidTokenError
-import uuid
-from fastapi import FastAPI, HTTPException, Query, Body, Depends, status
-from ldap3 import Server, Connection, ALL, BASE, SUBTREE, MODIFY_REPLACE, MODIFY_ADD, MODIFY_DELETE, Tls
-from typing import Dict
+import hashlib
+import json
+from contextlib import contextmanager
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Query, Body, Depends, Request, Response, status
+from ldap3 import Server, Connection, ALL, BASE, SUBTREE, MODIFY_REPLACE, MODIFY_ADD, MODIFY_DELETE, Tls, ASYNC_STREAM
+from ldap3.core.exceptions import LDAPException
+from typing import Dict, List, get_args, get_origin
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.routing import Match
 from datetime import datetime, timedelta, timezone
+from backend import metrics
+from backend.admission import AdmissionController, RateLimiter, Rejected, INTERACTIVE, BULK, parse_route_limits
+from backend.idalloc import IdAllocator, IdAllocationError
+from backend.pool import ConnectionPool, PoolExhausted
+from backend.events import EventBus, ChangeListener, TooManySubscribers, ACTIONS
+from backend.jobs import JobManager, JobKind, FINISHED
+from backend import filters
+from backend.filters import FilterPlanner, parse_indexes
+from backend.directory import DirectoryStore
+from backend.warmup import Warmup, WarmupStep
+from backend.prefetch import Prefetcher
 
 app = FastAPI(title="LDAP Crypto Dashboard API")
 
@@ -23,11 +43,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- ADMISSION CONTROL ---
+# Caps concurrent LDAP work so a burst degrades into fast 503s instead of exhausting slapd's connections
+admission = AdmissionController(
+    max_concurrency=int(os.getenv("LDAP_MAX_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("LDAP_QUEUE_SIZE", "64")),
+    queue_timeout=float(os.getenv("LDAP_QUEUE_TIMEOUT", "5")),
+    route_limits=parse_route_limits(os.getenv(
+        "LDAP_ROUTE_CONCURRENCY",
+        "/api/tree=2,/api/search/users=4,/api/search/groups=4,/api/groups/{group_cn}/members=4"
+    )),
+    bulk_share=float(os.getenv("LDAP_BULK_SHARE", "0.5")),
+)
+rate_limiter = RateLimiter(
+    rate=float(os.getenv("RATE_LIMIT_PER_SECOND", "20")),
+    burst=int(os.getenv("RATE_LIMIT_BURST", "40")),
+)
+
+# Routes that never touch LDAP skip admission entirely
+# (/api/events is a long-lived stream fed from memory; it must not pin a slot)
+ADMISSION_EXEMPT = {
+    "/metrics", "/healthz", "/readyz", "/api/me", "/api/events", "/api/jobs/{job_id}/stream",
+    "/docs", "/redoc", "/openapi.json",
+}
+
+# Scans and exports: served after interactive clicks when the backend is busy
+BULK_ROUTES = {
+    "/api/tree",
+    "/api/search/users",
+    "/api/search/groups",
+    "/api/groups/{group_cn}/members",
+}
+
+def _match_route(scope):
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+def _request_priority(request: Request, route_path: str):
+    if request.headers.get("x-request-priority", "").lower() == "bulk":
+        return BULK
+    if route_path in BULK_ROUTES:
+        return BULK
+    # Very large pages are exports, not someone clicking through a table
+    page_size = request.query_params.get("page_size", "")
+    if page_size.isdigit() and int(page_size) >= 500:
+        return BULK
+    return INTERACTIVE
+
+def _caller_key(request: Request):
+    """Rate limit by token subject when authenticated, otherwise by client address."""
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except InvalidTokenError:
+            pass
+    ip = request.headers.get("x-real-ip") or (request.client.host if request.client else "unknown")
+    return f"ip:{ip}"
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    route = _match_route(request.scope)
+    route_path = getattr(route, "path", None)
+    if route is None or route_path in ADMISSION_EXEMPT:
+        return await call_next(request)
+
+    # Let the metrics middleware label shed requests with their route template
+    request.scope["route"] = route
+    priority = _request_priority(request, route_path)
+    try:
+        rate_limiter.check(_caller_key(request))
+        await admission.acquire(route_path, priority)
+    except Rejected as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": "Too many requests" if e.status_code == 429 else "LDAP backend saturated, retry later",
+                     "reason": e.reason},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        admission.release(route_path, priority, held_for=time.perf_counter() - start)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Records rate/latency for every route, labelled by the route template (not the raw path)."""
+    start = time.perf_counter()
+    status_code = 500
+    metrics.HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        # Unmatched paths are collapsed so scanners can't blow up label cardinality
+        route_path = getattr(route, "path", None) or "unmatched"
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, route=route_path, method=request.method)
+        metrics.HTTP_REQUESTS.inc(route=route_path, method=request.method, status=status_code)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 # --- SECURITY CONFIG ---
 SECRET_KEY = os.getenv("JWT_SECRET", "super-secret-crypto-key")
 ALGORITHM = "HS256"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
+# EventSource can't send headers, so the change feed also accepts ?access_token=
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login", auto_error=False)
 # Config from Environment
 # LDAP_URL = os.getenv("LDAP_URL")
 LDAP_HOST = os.getenv("LDAP_HOST", "localhost")
@@ -44,6 +179,37 @@ IS_CONFIGURED = all([BASE_DN, ADMIN_DN, ADMIN_PW])
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# --- SEARCH PLANNING ---
+# Mirror of the server's olcDbIndex settings: the planner only emits assertions these can serve
+planner = FilterPlanner(
+    parse_indexes(os.getenv(
+        "LDAP_INDEXES",
+        "objectClass eq; uid,cn,mail,sn,givenName,displayName eq,sub; member,memberUid,uniqueMember eq; uidNumber,gidNumber eq"
+    )),
+    allow_substring=os.getenv("LDAP_SUBSTRING_SEARCH", "true").lower() == "true",
+    min_substring_length=int(os.getenv("LDAP_MIN_SUBSTRING_LENGTH", "3")),
+    min_prefix_length=int(os.getenv("LDAP_MIN_PREFIX_LENGTH", "2")),
+)
+SEARCH_SIZE_LIMIT = int(os.getenv("LDAP_SEARCH_SIZE_LIMIT", "500"))
+SEARCH_TIME_LIMIT = int(os.getenv("LDAP_SEARCH_TIME_LIMIT", "10"))
+
+# Local state (background jobs, ...) lives here; mount it as a volume to survive redeploys
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# POSIX ID allocation: blocks are reserved from counter entries under ID_POOL_DN
+ID_POOL_DN = os.getenv("ID_POOL_DN", f"ou=idpool,{BASE_DN}")
+ID_RANGE_START = int(os.getenv("ID_RANGE_START", "10000"))
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "100"))
+uid_allocator = IdAllocator("uidNumber", f"cn=uidNumber,{ID_POOL_DN}", BASE_DN, ID_RANGE_START, ID_BLOCK_SIZE)
+gid_allocator = IdAllocator("gidNumber", f"cn=gidNumber,{ID_POOL_DN}", BASE_DN, ID_RANGE_START, ID_BLOCK_SIZE)
+
+def allocate_id(allocator, conn):
+    try:
+        return str(allocator.allocate(conn))
+    except IdAllocationError as e:
+        print(f"ID Allocation Error: {e}")
+        raise HTTPException(status_code=503, detail=f"Could not allocate {allocator.kind}")
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -54,27 +220,67 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except InvalidTokenError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
     
+# Admin membership is checked on every admin route; cache the answer briefly. Writes to the
+# admins group (and user deletes/renames) seen on the change feed drop the cache at once.
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "30"))
+_admin_cache = {}  # username -> (is_admin, expires_at monotonic)
+
+def admins_group_dn():
+    return f"cn=admins,ou=groups,{BASE_DN}"
+
+def _lookup_admin(conn, username: str):
+    # Using both member (DN) and memberUid (UID string) for POSIX/Non-POSIX compatibility
+    user_dn = f"uid={username},ou=users,{BASE_DN}"
+    search_filter = filters.and_(
+        filters.eq("cn", "admins"),
+        filters.or_(filters.eq("member", user_dn), filters.eq("memberUid", username))
+    )
+    # Search only in the groups OU
+    conn.search(f"ou=groups,{BASE_DN}", search_filter, attributes=['1.1'])
+    return bool(conn.entries)
+
+def prime_admin_cache(conn):
+    """Reads the admins group once and caches every member as an admin."""
+    conn.search(f"ou=groups,{BASE_DN}", filters.eq("cn", "admins"), attributes=['member', 'memberUid'])
+    users_suffix = _normalize_dn(f"ou=users,{BASE_DN}")
+    names = set()
+    for entry in conn.entries:
+        for dn in (entry.member.values if 'member' in entry else []):
+            rdn, _, parent = str(dn).partition(',')
+            if rdn.lower().startswith('uid=') and _normalize_dn(parent) == users_suffix:
+                names.add(rdn[4:])
+        names.update(str(v) for v in (entry.memberUid.values if 'memberUid' in entry else []))
+    expires = time.monotonic() + ADMIN_CACHE_TTL
+    for name in names:
+        _admin_cache[name] = (True, expires)
+    return len(names)
+
+def invalidate_admin_cache(event):
+    if event["type"] == "user" and event["action"] in ("delete", "rename"):
+        _admin_cache.clear()
+    elif event["type"] == "group" and _normalize_dn(event["dn"]) == _normalize_dn(admins_group_dn()):
+        _admin_cache.clear()
+
 # Helper to check LDAP group membership
 def validate_admin(current_user: str = Depends(get_current_user)):
-    with get_conn() as conn:
-        # 1. Define the group search filter
-        # We check for the user in the 'admins' group
-        # Using both member (DN) and memberUid (UID string) for POSIX/Non-POSIX compatibility
-        user_dn = f"uid={current_user},ou=users,{BASE_DN}"
-        search_filter = f"(&(cn=admins)(|(member={user_dn})(memberUid={current_user})))"
-        
-        # 2. Search only in the groups OU
-        conn.search(f"ou=groups,{BASE_DN}", search_filter)
-        
-        # 3. If no entries found, they are NOT an admin
-        if not conn.entries:
-            print(f"Access Denied: {current_user} is not in 'admins' group")
-            raise HTTPException(
-                status_code=403, 
-                detail=f"Access denied: User '{current_user}' is not an administrator."
-            )
-            
-    # 4. If we reach here, they are an admin
+    cached = _admin_cache.get(current_user)
+    if cached and cached[1] > time.monotonic():
+        is_admin = cached[0]
+        metrics.record_cache("admin", True)
+    else:
+        metrics.record_cache("admin", False)
+        with get_conn() as conn:
+            is_admin = _lookup_admin(conn, current_user)
+        if ADMIN_CACHE_TTL > 0:
+            _admin_cache[current_user] = (is_admin, time.monotonic() + ADMIN_CACHE_TTL)
+
+    # If no entries found, they are NOT an admin
+    if not is_admin:
+        print(f"Access Denied: {current_user} is not in 'admins' group")
+        raise HTTPException(
+            status_code=403, 
+            detail=f"Access denied: User '{current_user}' is not an administrator."
+        )
     return current_user
 
 def check_config():
@@ -89,25 +295,236 @@ def check_config():
             }
         )
 
+class InstrumentedConnection(Connection):
+    """ldap3 Connection that reports opens, binds and per-operation latency to /metrics."""
+
+    def __init__(self, *args, **kwargs):
+        # ldap3 binds the strategy's open() onto the instance, so count here instead of overriding it
+        metrics.LDAP_CONNECTIONS_OPENED.inc()
+        super().__init__(*args, **kwargs)
+
+    def bind(self, read_server_info=True, controls=None):
+        # The shared Server already holds the schema after the first bind; re-reading the
+        # whole subschema entry on every login and pooled connection is pure overhead
+        if self.server.schema is not None and self.server.info is not None:
+            read_server_info = False
+        try:
+            ok = super().bind(read_server_info, controls)
+        except Exception:
+            metrics.LDAP_BINDS.inc(result="error")
+            raise
+        metrics.LDAP_BINDS.inc(result="success" if ok else "failure")
+        return ok
+
+    def _timed(self, operation, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result_code = "error"
+        try:
+            ok = fn(*args, **kwargs)
+            result = self.result if isinstance(self.result, dict) else {}
+            result_code = result.get('description') or ("success" if ok else "failure")
+            return ok
+        finally:
+            metrics.LDAP_OP_LATENCY.observe(time.perf_counter() - start, operation=operation, result=result_code)
+
+    def search(self, *args, **kwargs):
+        return self._timed("search", super().search, *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._timed("add", super().add, *args, **kwargs)
+
+    def modify(self, *args, **kwargs):
+        return self._timed("modify", super().modify, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._timed("delete", super().delete, *args, **kwargs)
+
+    def modify_dn(self, *args, **kwargs):
+        return self._timed("modify_dn", super().modify_dn, *args, **kwargs)
+
+    def compare(self, *args, **kwargs):
+        return self._timed("compare", super().compare, *args, **kwargs)
+
+    def extended(self, *args, **kwargs):
+        return self._timed("extended", super().extended, *args, **kwargs)
+
+def open_admin_conn():
+    # We use the ADMIN_DN for all management operations
+    return InstrumentedConnection(get_ldap_server(), user=ADMIN_DN, password=ADMIN_PW, auto_bind=True)
+
+ldap_pool = ConnectionPool(
+    open_admin_conn,
+    max_size=int(os.getenv("LDAP_POOL_SIZE", "20")),
+    acquire_timeout=float(os.getenv("LDAP_POOL_TIMEOUT", "10")),
+    max_idle=float(os.getenv("LDAP_POOL_MAX_IDLE", "60")),
+)
+
+@contextmanager
 def get_conn():
-    server = get_ldap_server()
-    
+    """Leases an admin-bound connection from the pool for the duration of the `with` block."""
     try:
-        # We use the ADMIN_DN for all management operations
-        return Connection(server, user=ADMIN_DN, password=ADMIN_PW, auto_bind=True)
+        conn = ldap_pool.acquire()
+    except PoolExhausted as e:
+        print(f"LDAP Pool Exhausted: {e}")
+        raise HTTPException(status_code=503, detail="LDAP connection pool exhausted", headers={"Retry-After": "1"})
     except Exception as e:
         print(f"LDAP Connection Error: {e}")
         raise HTTPException(status_code=500, detail="Internal LDAP Connection Error")
 
+    broken = False
+    try:
+        yield conn
+    except LDAPException:
+        # Socket/protocol level failure: don't hand this connection to the next request
+        broken = True
+        raise
+    finally:
+        ldap_pool.release(conn, broken)
+
+# --- CHANGE FEED ---
+def classify_dn(dn: str):
+    dn = _normalize_dn(dn)
+    if dn.endswith(_normalize_dn(f"ou=users,{BASE_DN}")):
+        return "user"
+    if dn.endswith(_normalize_dn(f"ou=groups,{BASE_DN}")):
+        return "group"
+    return "entry"
+
+event_bus = EventBus(
+    classify=classify_dn,
+    history=int(os.getenv("EVENTS_HISTORY", "1000")),
+    max_queue=int(os.getenv("EVENTS_CLIENT_QUEUE", "256")),
+    max_subscribers=int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "500")),
+)
+event_bus.add_listener(invalidate_admin_cache)
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+def open_stream_conn():
+    return Connection(get_ldap_server(), user=ADMIN_DN, password=ADMIN_PW,
+                      client_strategy=ASYNC_STREAM, auto_bind=True)
+
+# "poll" works everywhere (OpenLDAP has no persistent search); "psearch" for 389-DS/AD; "off"
+change_listener = ChangeListener(
+    event_bus,
+    mode=os.getenv("LDAP_CHANGE_LISTENER", "poll"),
+    base_dn=BASE_DN,
+    pool=ldap_pool,
+    stream_factory=open_stream_conn,
+    interval=float(os.getenv("LDAP_CHANGE_POLL_INTERVAL", "10")),
+    clock_skew=float(os.getenv("LDAP_CHANGE_CLOCK_SKEW", "2")),
+)
+
+@app.on_event("startup")
+def start_change_listener():
+    if IS_CONFIGURED:
+        change_listener.start()
+
+@app.on_event("shutdown")
+def stop_change_listener():
+    change_listener.stop()
+
+_ldap_server = None
+_ldap_server_lock = threading.Lock()
+
 def get_ldap_server():
-    """Configures the Server object with SSL/TLS if enabled."""
-    if LDAP_USE_SSL:
-        # validate=ssl.CERT_NONE allows self-signed certs often used in custom LDAP
-        tls_config = Tls(validate=ssl.CERT_NONE, version=ssl.PROTOCOL_TLSv1_2)
-        return Server(LDAP_HOST, port=LDAP_PORT, use_ssl=True, tls=tls_config, get_info=ALL)
-    else:
-        return Server(LDAP_HOST, port=LDAP_PORT, use_ssl=False, get_info=ALL)
+    """
+    Configures the Server object with SSL/TLS if enabled. One Server is shared by every
+    connection, so the root DSE and schema it carries are read once, not on every bind.
+    """
+    global _ldap_server
+    with _ldap_server_lock:
+        if _ldap_server is None:
+            if LDAP_USE_SSL:
+                # validate=ssl.CERT_NONE allows self-signed certs often used in custom LDAP
+                tls_config = Tls(validate=ssl.CERT_NONE, version=ssl.PROTOCOL_TLSv1_2)
+                _ldap_server = Server(LDAP_HOST, port=LDAP_PORT, use_ssl=True, tls=tls_config, get_info=ALL)
+            else:
+                _ldap_server = Server(LDAP_HOST, port=LDAP_PORT, use_ssl=False, get_info=ALL)
+        return _ldap_server
     
+# --- CONDITIONAL GET ---
+# entryCSN (OpenLDAP) / modifyTimestamp change on every write, so they make cheap validators:
+# a revalidation only reads these operational attributes instead of the whole entry.
+VERSION_ATTRS = ['entryCSN', 'modifyTimestamp']
+
+def supported_attrs(conn, names):
+    """Drops attributes the server's schema doesn't know (ldap3 refuses to request them)."""
+    schema = conn.server.schema
+    if not schema:
+        return list(names)
+    return [n for n in names if n in schema.attribute_types]
+
+def _attr_value(entry, name):
+    return entry[name].value if name in entry else None
+
+def entry_etag(entry):
+    """Strong ETag from the entry's version attributes, or None if the server doesn't expose them."""
+    csn = _attr_value(entry, 'entryCSN')
+    modified = _attr_value(entry, 'modifyTimestamp')
+    if not csn and not modified:
+        return None
+    digest = hashlib.sha1(f"{entry.entry_dn}|{csn}|{modified}".encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+def content_etag(payload):
+    """Fallback ETag hashed from the response body: saves the transfer, not the LDAP read."""
+    body = json.dumps(payload, sort_keys=True, default=str).encode()
+    return f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+def entry_last_modified(entry):
+    modified = _attr_value(entry, 'modifyTimestamp')
+    if isinstance(modified, datetime):
+        return modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+    return None
+
+def is_not_modified(request: Request, etag, last_modified=None):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+        if not etag:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def validator_headers(etag, last_modified=None):
+    # no-cache: the browser may keep the body but must revalidate before reusing it
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def not_modified_response(etag, last_modified=None):
+    metrics.record_cache("conditional_get", True)
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+def conditional_payload(request: Request, response: Response, payload, etag=None, last_modified=None):
+    """Returns a 304 if the client's copy is current, otherwise the payload with validators attached."""
+    etag = etag or content_etag(payload)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    if request.headers.get("if-none-match") or request.headers.get("if-modified-since"):
+        metrics.record_cache("conditional_get", False)
+    response.headers.update(validator_headers(etag, last_modified))
+    return payload
+
+def entry_payload(entry):
+    attrs = entry.entry_attributes_as_dict
+    return {k: v for k, v in attrs.items() if k not in VERSION_ATTRS}
+
+def has_validators(request: Request):
+    return bool(request.headers.get("if-none-match") or request.headers.get("if-modified-since"))
+
 # --- USER APIS ---
 search_attrs = [
     'uid',            # Login username (e.g., 'satoshi')
@@ -118,6 +535,7 @@ search_attrs = [
     'displayName',    # Friendly UI name
     'description'     # Notes about the user
 ]
+USER_LIST_FILTER = '(objectClass=person)'
 
 def create_access_token(username: str):
     payload = {
@@ -133,7 +551,7 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 @app.post("/api/login")
-async def login(username: str = Body(...), password: str = Body(...)):
+def login(username: str = Body(...), password: str = Body(...)):
     """Authenticate via LDAP SSL and return a JWT."""
     server = get_ldap_server()
     
@@ -147,14 +565,16 @@ async def login(username: str = Body(...), password: str = Body(...)):
     
     for user_dn in possible_dns:
         try:
-            with Connection(server, user=user_dn, password=password, auto_bind=True) as conn:
+            with InstrumentedConnection(server, user=user_dn, password=password, auto_bind=True) as conn:
                 # If we get here, bind was successful
                 token = create_access_token(data={"sub": username})
+                metrics.LOGIN_ATTEMPTS.inc(result="success")
                 return {"access_token": token, "token_type": "bearer"}
         except Exception:
             continue # Try the next DN pattern
             
     # If all patterns fail
+    metrics.LOGIN_ATTEMPTS.inc(result="failure")
     raise HTTPException(status_code=401, detail="Invalid LDAP Credentials")
 
 # Example of a protected route
@@ -166,60 +586,124 @@ async def get_me(token: str = Depends(oauth2_scheme)):
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     
-@app.get("/api/users")
-async def list_users(page_size: int = Query(10, ge=1, le=1000), cookie: str = None):
-    """List all users with pagination and explicit attributes."""
-    decoded_cookie = base64.b64decode(cookie) if cookie else None
-    
-    # We define exactly what fields we want to show in our React table
-
+# --- NEXT-PAGE PREFETCH ---
+# After a listing page is served, the next one is read ahead in the background (see
+# backend/prefetch.py); only while LDAP has spare capacity, so read-ahead never competes with clicks
+def prefetch_allowed():
+    pool = ldap_pool.stats()
+    return admission.in_flight < admission.bulk_limit and pool["in_use"] < pool["max_size"] // 2
+
+def refresh_page(kind: str, page):
+    """
+    Re-reads the rows of a prefetched page that predates a write. Its cookie was already
+    used, so the page can't be fetched again; entries that were deleted or no longer match
+    the listing drop out, and the page keeps its place in the listing.
+    """
+    listing_filter, attrs, row = {
+        "users": (USER_LIST_FILTER, search_attrs, user_row),
+        "groups": (GROUP_LIST_FILTER, GROUP_LIST_ATTRS, group_row),
+    }[kind]
+    results = []
     with get_conn() as conn:
-        conn.search(
-            search_base=BASE_DN,
-            search_filter='(objectClass=person)',
-            search_scope=SUBTREE,
-            attributes=search_attrs,  # <--- CRITICAL: Tells LDAP what to return
-            paged_size=page_size,
-            paged_cookie=decoded_cookie
-        )
+        for item in page["results"]:
+            if conn.search(item["dn"], listing_filter, search_scope=BASE, attributes=attrs) and conn.entries:
+                results.append(row(conn.entries[0]))
+    return {"results": results, "next_cookie": page["next_cookie"]}
+
+prefetcher = Prefetcher(
+    workers=int(os.getenv("PREFETCH_WORKERS", "2")),
+    max_pages=int(os.getenv("PREFETCH_MAX_PAGES", "200")),
+    ttl=float(os.getenv("PREFETCH_TTL", "30")),
+    max_depth=int(os.getenv("PREFETCH_MAX_DEPTH", "3")),
+    horizon=float(os.getenv("PREFETCH_HORIZON", "3")),
+    max_page_size=int(os.getenv("PREFETCH_MAX_PAGE_SIZE", "200")),
+    can_fetch=prefetch_allowed,
+    refresh=refresh_page,
+)
+# Any write, ours or seen by the change listener, can change rows of buffered pages
+event_bus.add_listener(lambda event: prefetcher.clear())
 
-        # We format the entries to make sure they are JSON serializable
-        # LDAP often returns values as lists; we extract the first value for the UI
-        results = []
-        for e in conn.entries:
-            results.append({
-                "dn": e.entry_dn,
-                "uid": e.uid.value if hasattr(e, 'uid') else "N/A",
-                "cn": e.cn.value if hasattr(e, 'cn') else "N/A",
-                "mail": e.mail.value if hasattr(e, 'mail') else "N/A",
-                "title": e.title.value if hasattr(e, 'title') else "General Member", # New field
-                "status": "Active"
-            })
+def prefetch_page(build, page_size: int, cookie: str):
+    with ldap_pool.lease() as conn:
+        return build(conn, page_size, base64.b64decode(cookie))
 
-        # Pagination Cookie Logic
-        resp_cookie = None
-        controls = conn.result.get('controls', {})
-        paged_control = controls.get('1.2.840.113556.1.4.319', {})
-        raw_cookie = paged_control.get('value', {}).get('cookie')
-        if raw_cookie:
-            resp_cookie = base64.b64encode(raw_cookie).decode('utf-8')
+def fetch_page(build, page_size: int, decoded_cookie):
+    """A listing page fetched for the request itself (no prefetched copy was available)."""
+    with get_conn() as conn:
+        return build(conn, page_size, decoded_cookie)
+
+@app.on_event("shutdown")
+def stop_prefetcher():
+    prefetcher.stop()
+
+def user_row(e):
+    # We format the entries to make sure they are JSON serializable
+    # LDAP often returns values as lists; we extract the first value for the UI
+    return {
+        "dn": e.entry_dn,
+        "uid": e.uid.value if hasattr(e, 'uid') else "N/A",
+        "cn": e.cn.value if hasattr(e, 'cn') else "N/A",
+        "mail": e.mail.value if hasattr(e, 'mail') else "N/A",
+        "title": e.title.value if hasattr(e, 'title') else "General Member", # New field
+        "status": "Active"
+    }
+
+def users_page(conn, page_size: int, decoded_cookie):
+    conn.search(
+        search_base=BASE_DN,
+        search_filter=USER_LIST_FILTER,
+        search_scope=SUBTREE,
+        attributes=search_attrs,  # <--- CRITICAL: Tells LDAP what to return
+        paged_size=page_size,
+        paged_cookie=decoded_cookie
+    )
+
+    results = [user_row(e) for e in conn.entries]
+
+    # Pagination Cookie Logic
+    resp_cookie = None
+    controls = conn.result.get('controls', {})
+    paged_control = controls.get('1.2.840.113556.1.4.319', {})
+    raw_cookie = paged_control.get('value', {}).get('cookie')
+    if raw_cookie:
+        resp_cookie = base64.b64encode(raw_cookie).decode('utf-8')
+    return {"results": results, "next_cookie": resp_cookie}
 
-        return {"results": results, "next_cookie": resp_cookie}
+@app.get("/api/users")
+async def list_users(page_size: int = Query(10, ge=1, le=1000), cookie: str = None):
+    """List all users with pagination and explicit attributes."""
+    page, session = await prefetcher.take("users", page_size, cookie)
+    if page is None:
+        decoded_cookie = base64.b64decode(cookie) if cookie else None
+        # Off the event loop: leasing can wait up to LDAP_POOL_TIMEOUT when the pool is busy
+        page = await run_in_threadpool(fetch_page, users_page, page_size, decoded_cookie)
+    metrics.track_paging(cookie, page["next_cookie"])
+    prefetcher.after_serve("users", page_size, page["next_cookie"],
+                           lambda c: prefetch_page(users_page, page_size, c), session)
+    return page
 
 @app.get("/api/users/{username}")
-async def get_user(username: str):
-    """Fetch specific user details."""
+def get_user(username: str, request: Request, response: Response):
+    """Fetch specific user details. Supports If-None-Match / If-Modified-Since."""
+    user_filter = filters.and_(filters.eq("objectClass", "person"), filters.eq("uid", username))
     with get_conn() as conn:
-        conn.search(BASE_DN, f'(&(objectClass=person)(uid={username}))', SUBTREE, attributes=['*'])
+        version_attrs = supported_attrs(conn, VERSION_ATTRS)
+        if has_validators(request) and version_attrs:
+            # Cheap revalidation: only the version attributes, no full entry read
+            conn.search(BASE_DN, user_filter, SUBTREE, attributes=version_attrs)
+            if conn.entries:
+                entry = conn.entries[0]
+                etag = entry_etag(entry)
+                if etag and is_not_modified(request, etag, entry_last_modified(entry)):
+                    return not_modified_response(etag, entry_last_modified(entry))
+
+        conn.search(BASE_DN, user_filter, SUBTREE, attributes=['*'] + version_attrs)
         if not conn.entries: raise HTTPException(status_code=404, detail="User not found")
-        return conn.entries[0].entry_attributes_as_dict
+        entry = conn.entries[0]
+        return conditional_payload(request, response, entry_payload(entry),
+                                   entry_etag(entry), entry_last_modified(entry))
 
-@app.post("/api/users")
-async def add_user(attributes: Dict, admin: str = Depends(validate_admin)):
-    """
-    Simulates FreeIPA user creation logic.
-    Expects: username (uid), first_name (givenName), last_name (sn), password
-    """
+def add_user_op(conn, attributes: Dict):
     # 1. Extract FreeIPA-style fields from payload
     uid = attributes.get('username')
     first_name = attributes.get('first_name', '')
@@ -253,73 +737,146 @@ async def add_user(attributes: Dict, admin: str = Depends(validate_admin)):
         obj_classes.append('posixAccount')
         # posixAccount also requires homeDirectory and uidNumber
         ldap_attrs['homeDirectory'] = f"/home/{uid}"
-        ldap_attrs['uidNumber'] = str(uuid.uuid4().int)[:5] # Simple unique ID logic
 
     target_ou = f"ou=users,{BASE_DN}"
     user_dn = f"uid={uid},{target_ou}"
     
+    conn.search(target_ou, '(objectClass=*)', search_scope=BASE)
+
+    if not conn.entries:
+        print(f"Creating missing OU: {target_ou}")
+        success = conn.add(target_ou, ['top', 'organizationalUnit'], {'ou': 'users'})
+
+        if not success:
+            raise HTTPException(status_code=400, detail=f"LDAP Write Failed: {conn.result.get('description')}")
+
+    if 'posixAccount' in obj_classes:
+        # Reserved from the directory counter in blocks, so this is usually a memory read
+        ldap_attrs['uidNumber'] = allocate_id(uid_allocator, conn)
+
+    if not conn.add(user_dn, obj_classes, ldap_attrs):
+        error_desc = conn.result.get('description', 'Unknown Error')
+        raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
+
+    event_bus.publish("add", user_dn)
+    return {"status": "success", "uid": uid, "dn": user_dn}
+
+@app.post("/api/users")
+def add_user(attributes: Dict, admin: str = Depends(validate_admin)):
+    """
+    Simulates FreeIPA user creation logic.
+    Expects: username (uid), first_name (givenName), last_name (sn), password
+    """
     with get_conn() as conn:
-        conn.search(target_ou, '(objectClass=*)', search_scope=BASE)
-        
-        if not conn.entries:
-            print(f"Creating missing OU: {target_ou}")
-            success = conn.add(target_ou, ['top', 'organizationalUnit'], {'ou': 'users'})
-            
-            if not success:
-                raise HTTPException(status_code=400, detail=f"LDAP Write Failed: {conn.result.get('description')}")
-        
-        if not conn.add(user_dn, obj_classes, ldap_attrs):
-            error_desc = conn.result.get('description', 'Unknown Error')
-            raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
-            
-        return {"status": "success", "uid": uid, "dn": user_dn}
+        return add_user_op(conn, attributes)
+
     
+def update_user_op(conn, uid: str, updates: Dict):
+    # 1. Find the user's DN
+    conn.search(BASE_DN, filters.eq("uid", uid), SUBTREE)
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user_dn = conn.entries[0].entry_dn
+
+    # 2. Format changes for LDAP
+    # We filter out sensitive or immutable keys like 'uid' or 'dn'
+    ldap_changes = {}
+    for k, v in updates.items():
+        if k not in ['dn', 'uid', 'objectClass'] and v:
+            ldap_changes[k] = [(MODIFY_REPLACE, [str(v)])]
+
+    if not conn.modify(user_dn, ldap_changes):
+        raise HTTPException(status_code=400, detail=conn.result['description'])
+    event_bus.publish("modify", user_dn, attributes=sorted(ldap_changes))
+    return {"message": "User updated successfully"}
+
 @app.patch("/api/users/{uid}")
-async def update_user(uid: str, updates: Dict, admin: str = Depends(validate_admin)):
+def update_user(uid: str, updates: Dict, admin: str = Depends(validate_admin)):
     """
     Search for the user by UID to get their full DN, then apply changes.
     """
     with get_conn() as conn:
-        # 1. Find the user's DN
-        conn.search(BASE_DN, f'(uid={uid})', SUBTREE)
-        if not conn.entries:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_dn = conn.entries[0].entry_dn
-        
-        # 2. Format changes for LDAP
-        # We filter out sensitive or immutable keys like 'uid' or 'dn'
-        ldap_changes = {}
-        for k, v in updates.items():
-            if k not in ['dn', 'uid', 'objectClass'] and v:
-                ldap_changes[k] = [(MODIFY_REPLACE, [str(v)])]
+        return update_user_op(conn, uid, updates)
+
+
+def delete_user_op(conn, uid: str):
+    # 1. Find the user first to get their full DN
+    conn.search(BASE_DN, filters.eq("uid", uid), search_scope=SUBTREE)
+
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        if not conn.modify(user_dn, ldap_changes):
-            raise HTTPException(status_code=400, detail=conn.result['description'])
-        return {"message": "User updated successfully"}
+    user_dn = conn.entries[0].entry_dn
+
+    # 2. Perform the delete
+    if not conn.delete(user_dn):
+        error_msg = conn.result.get('description', 'Unknown Error')
+        raise HTTPException(status_code=400, detail=f"Failed to delete: {error_msg}")
+
+    event_bus.publish("delete", user_dn)
+    return {"status": "success", "message": f"User {uid} deleted successfully"}
 
 @app.delete("/api/users/{uid}")
-async def delete_user(uid: str, admin: str = Depends(validate_admin)):
+def delete_user(uid: str, admin: str = Depends(validate_admin)):
     """
     Deletes a user from LDAP.
     """
-    # 1. Find the user first to get their full DN
     with get_conn() as conn:
-        conn.search(BASE_DN, f'(uid={uid})', search_scope=SUBTREE)
-        
-        if not conn.entries:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_dn = conn.entries[0].entry_dn
+        return delete_user_op(conn, uid)
 
-        # 2. Perform the delete
-        if not conn.delete(user_dn):
-            error_msg = conn.result.get('description', 'Unknown Error')
-            raise HTTPException(status_code=400, detail=f"Failed to delete: {error_msg}")
-            
-        return {"status": "success", "message": f"User {uid} deleted successfully"}
 # --- GROUP APIS ---
 
+GROUP_LIST_FILTER = '(|(objectClass=groupOfNames)(objectClass=posixGroup))'
+GROUP_LIST_ATTRS = ['cn', 'description', 'gidNumber', 'member', 'memberUid', 'objectClass']
+
+def group_row(e):
+    # Fix 3: Safer attribute extraction
+    members = e.member.values if hasattr(e, 'member') else []
+    posix_members = e.memberUid.values if hasattr(e, 'memberUid') else []
+    
+    # Check for gidNumber safely
+    gid = None
+    if hasattr(e, 'gidNumber') and e.gidNumber.value:
+        try:
+            gid = int(e.gidNumber.value)
+        except (ValueError, TypeError):
+            gid = None
+
+    return {
+        "dn": e.entry_dn,
+        "cn": str(e.cn.value) if hasattr(e, 'cn') else "Unknown",
+        "description": str(e.description.value) if hasattr(e, 'description') else "",
+        "gidNumber": gid,
+        "memberCount": len(set(list(members) + list(posix_members))),
+        "type": "Hybrid" if ('posixGroup' in e.objectClass.values and 'groupOfNames' in e.objectClass.values) else "Standard"
+    }
+
+def groups_page(conn, page_size: int, decoded_cookie):
+    # Fix 2: Explicitly use search_scope=SUBTREE
+    conn.search(
+        BASE_DN, 
+        GROUP_LIST_FILTER, 
+        search_scope=SUBTREE, # Changed from positional to keyword
+        attributes=GROUP_LIST_ATTRS,
+        paged_size=page_size, 
+        paged_cookie=decoded_cookie
+    )
+    
+    results = [group_row(e) for e in conn.entries]
+
+    # Fix 4: Safer Pagination extraction
+    resp_cookie = None
+    controls = conn.result.get('controls', {})
+    # Look for the paged results control OID
+    paged_control = controls.get('1.2.840.113556.1.4.319', {}).get('value', {})
+    
+    # Support both library versions of cookie storage
+    raw_cookie = paged_control.get('cookie') if isinstance(paged_control, dict) else None
+    if raw_cookie:
+        resp_cookie = base64.b64encode(raw_cookie).decode('utf-8')
+    return {"results": results, "next_cookie": resp_cookie}
+
 @app.get("/api/groups")
 async def list_groups(page_size: int = Query(10, ge=1, le=1000), cookie: str = None):
     # Fix 1: Safer cookie decoding
@@ -329,57 +886,15 @@ async def list_groups(page_size: int = Query(10, ge=1, le=1000), cookie: str = N
             decoded_cookie = base64.b64decode(cookie)
         except Exception:
             decoded_cookie = None
-    
-    search_filter = '(|(objectClass=groupOfNames)(objectClass=posixGroup))'
-    attrs = ['cn', 'description', 'gidNumber', 'member', 'memberUid', 'objectClass']
 
     try:
-        with get_conn() as conn:
-            # Fix 2: Explicitly use search_scope=SUBTREE
-            conn.search(
-                BASE_DN, 
-                search_filter, 
-                search_scope=SUBTREE, # Changed from positional to keyword
-                attributes=attrs,
-                paged_size=page_size, 
-                paged_cookie=decoded_cookie
-            )
-            
-            results = []
-            for e in conn.entries:
-                # Fix 3: Safer attribute extraction
-                members = e.member.values if hasattr(e, 'member') else []
-                posix_members = e.memberUid.values if hasattr(e, 'memberUid') else []
-                
-                # Check for gidNumber safely
-                gid = None
-                if hasattr(e, 'gidNumber') and e.gidNumber.value:
-                    try:
-                        gid = int(e.gidNumber.value)
-                    except (ValueError, TypeError):
-                        gid = None
-
-                results.append({
-                    "dn": e.entry_dn,
-                    "cn": str(e.cn.value) if hasattr(e, 'cn') else "Unknown",
-                    "description": str(e.description.value) if hasattr(e, 'description') else "",
-                    "gidNumber": gid,
-                    "memberCount": len(set(list(members) + list(posix_members))),
-                    "type": "Hybrid" if ('posixGroup' in e.objectClass.values and 'groupOfNames' in e.objectClass.values) else "Standard"
-                })
-
-            # Fix 4: Safer Pagination extraction
-            resp_cookie = None
-            controls = conn.result.get('controls', {})
-            # Look for the paged results control OID
-            paged_control = controls.get('1.2.840.113556.1.4.319', {}).get('value', {})
-            
-            # Support both library versions of cookie storage
-            raw_cookie = paged_control.get('cookie') if isinstance(paged_control, dict) else None
-            if raw_cookie:
-                resp_cookie = base64.b64encode(raw_cookie).decode('utf-8')
-
-            return {"results": results, "next_cookie": resp_cookie}
+        page, session = await prefetcher.take("groups", page_size, cookie if decoded_cookie else None)
+        if page is None:
+            page = await run_in_threadpool(fetch_page, groups_page, page_size, decoded_cookie)
+        metrics.track_paging(cookie if decoded_cookie else None, page["next_cookie"])
+        prefetcher.after_serve("groups", page_size, page["next_cookie"],
+                               lambda c: prefetch_page(groups_page, page_size, c), session)
+        return page
             
     except Exception as e:
         print(f"LIST GROUPS CRASH: {str(e)}")
@@ -387,13 +902,7 @@ async def list_groups(page_size: int = Query(10, ge=1, le=1000), cookie: str = N
 # 1. Make sure you have the import at the top of main.py
 
 # 2. Update the search line in create_group
-@app.post("/api/groups")
-async def create_group(
-    name: str = Body(..., embed=True), 
-    description: str = Body(None, embed=True),
-    group_type: str = Body("posix", embed=True),
-    gid: int = Body(None, embed=True)
-):
+def create_group_op(conn, name: str, description: str = None, group_type: str = "posix", gid: int = None):
     parent_dn = f"ou=groups,{BASE_DN}"
     group_dn = f"cn={name},{parent_dn}"
     
@@ -409,9 +918,8 @@ async def create_group(
         # For POSIX, we use memberUid (which stores just the 'username') 
         # instead of 'member' (which stores the full DN)
         obj_classes.append('posixGroup')
-        if not gid:
-            raise HTTPException(status_code=400, detail="GID required for POSIX")
-        attributes['gidNumber'] = str(gid)
+        if gid:
+            attributes['gidNumber'] = str(gid)
         # posixGroup uses 'memberUid'. We'll add a placeholder username.
         attributes['memberUid'] = ['admin'] 
     else:
@@ -419,23 +927,32 @@ async def create_group(
         obj_classes.append('groupOfNames')
         attributes['member'] = [ADMIN_DN]
 
-    with get_conn() as conn:
-        # Check for OU... (keep your existing OU check logic)
-        
-        if not conn.add(group_dn, obj_classes, attributes):
-            error_msg = conn.result.get('description', 'Unknown Error')
-            # If it still fails, it's likely a schema conflict
-            raise HTTPException(status_code=400, detail=f"LDAP Error: {error_msg}")
-            
-        return {"status": "success", "dn": group_dn}
-    
-    
-@app.post("/api/groups/{group_cn}/update")
-async def update_group(
-    group_cn: str,
+    # Check for OU... (keep your existing OU check logic)
+
+    if 'posixGroup' in obj_classes and 'gidNumber' not in attributes:
+        # No GID given: take the next one from the allocator
+        attributes['gidNumber'] = allocate_id(gid_allocator, conn)
+
+    if not conn.add(group_dn, obj_classes, attributes):
+        error_msg = conn.result.get('description', 'Unknown Error')
+        # If it still fails, it's likely a schema conflict
+        raise HTTPException(status_code=400, detail=f"LDAP Error: {error_msg}")
+
+    event_bus.publish("add", group_dn)
+    return {"status": "success", "dn": group_dn, "gidNumber": attributes.get('gidNumber')}
+
+@app.post("/api/groups")
+def create_group(
+    name: str = Body(..., embed=True), 
     description: str = Body(None, embed=True),
+    group_type: str = Body("posix", embed=True),
     gid: int = Body(None, embed=True)
 ):
+    with get_conn() as conn:
+        return create_group_op(conn, name, description, group_type, gid)
+    
+    
+def update_group_op(conn, group_cn: str, description: str = None, gid: int = None):
     group_dn = f"cn={group_cn},ou=groups,{BASE_DN}"
     
     # Prepare modifications
@@ -448,135 +965,212 @@ async def update_group(
     if not changes:
         return {"status": "no_changes"}
 
+    if not conn.modify(group_dn, changes):
+        error_msg = conn.result.get('description', 'Unknown Error')
+        raise HTTPException(status_code=400, detail=f"Update failed: {error_msg}")
+
+    event_bus.publish("modify", group_dn, attributes=sorted(changes))
+    return {"status": "success", "message": f"Group {group_cn} updated"}
+
+@app.post("/api/groups/{group_cn}/update")
+def update_group(
+    group_cn: str,
+    description: str = Body(None, embed=True),
+    gid: int = Body(None, embed=True)
+):
     with get_conn() as conn:
-        if not conn.modify(group_dn, changes):
-            error_msg = conn.result.get('description', 'Unknown Error')
-            raise HTTPException(status_code=400, detail=f"Update failed: {error_msg}")
-            
-        return {"status": "success", "message": f"Group {group_cn} updated"}
+        return update_group_op(conn, group_cn, description, gid)
+
         
 
-@app.post("/api/users/{username}/disable")
-async def disable_user(username: str):
-    """Disable user (locking bind) by changing password to something invalid."""
+def disable_user_op(conn, username: str):
     user_dn = f"uid={username},ou=users,{BASE_DN}"
     # In OpenLDAP, 'locking' is often done by prefixing the password with {LOCKED}
+    if not conn.modify(user_dn, {'userPassword': [(MODIFY_REPLACE, ['{LOCKED}'])]}):
+        error_desc = conn.result.get('description', 'Unknown Error')
+        if error_desc == 'noSuchObject':
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=500, detail=f"Failed to disable user: {error_desc}")
+    event_bus.publish("modify", user_dn, attributes=["userPassword"])
+    return {"message": "User disabled"}
+
+@app.post("/api/users/{username}/disable")
+def disable_user(username: str):
+    """Disable user (locking bind) by changing password to something invalid."""
     with get_conn() as conn:
-        conn.modify(user_dn, {'userPassword': [(MODIFY_REPLACE, ['{LOCKED}'])]})
-        return {"message": "User disabled"}
+        return disable_user_op(conn, username)
+
     
 # --- SEARCH APIS ---
-@app.post("/api/users/{username}/password")
-async def reset_password(username: str, new_password: str = Body(..., embed=True)):
+def reset_password_op(conn, username: str, new_password: str):
     user_dn = f"uid={username},ou=users,{BASE_DN}"
     
+    # We use the password_modify extended operation for maximum compatibility
+    if not conn.extend.standard.modify_password(user=user_dn, new_password=new_password):
+        error_desc = conn.result.get('description', 'Unknown Error')
+        raise HTTPException(status_code=400, detail=f"Password reset failed: {error_desc}")
+
+    event_bus.publish("modify", user_dn, attributes=["userPassword"])
+    return {"status": "success", "message": f"Password for {username} has been reset."}
+
+@app.post("/api/users/{username}/password")
+def reset_password(username: str, new_password: str = Body(..., embed=True)):
     with get_conn() as conn:
-        # We use the password_modify extended operation for maximum compatibility
-        if not conn.extend.standard.modify_password(user=user_dn, new_password=new_password):
-            error_desc = conn.result.get('description', 'Unknown Error')
-            raise HTTPException(status_code=400, detail=f"Password reset failed: {error_desc}")
-            
-        return {"status": "success", "message": f"Password for {username} has been reset."}
+        return reset_password_op(conn, username, new_password)
+
     
 @app.get("/api/search/users")
-async def search_users(q: str = Query(...)):
-    # 1. Broaden the filter: Remove objectClass requirement for now
-    # 2. Add sn (surname) and displayName to the OR logic
-    search_filter = f"(|(uid=*{q}*)(cn=*{q}*)(mail=*{q}*)(sn=*{q}*)(displayName=*{q}*))"
+def search_users(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=SEARCH_SIZE_LIMIT),
+    match: str = Query("auto", enum=list(filters.MODES))
+):
+    # 1. Match uid, cn, mail, sn and displayName; the planner picks indexed forms per attribute
+    search_attrs = ['uid', 'cn', 'mail', 'sn', 'displayName']
     
     with get_conn() as conn:
-        # Ensure search_base is the ROOT of your directory
-        conn.search(
-            search_base="dc=crypto,dc=lake", 
-            search_filter=search_filter,
-            search_scope=SUBTREE,
-            attributes=['uid', 'cn', 'mail']
-        )
-        
-        # Check if we got anything
+        schema = conn.server.schema
+        # 2. auto: prefix matches first, contains only if they didn't fill the page
+        try:
+            stages = planner.stages(search_attrs, q, schema) if match == "auto" \
+                else [planner.match(search_attrs, q, match, schema)]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         results = []
-        for e in conn.entries:
-            results.append({
-                "dn": e.entry_dn,
-                "uid": str(e.uid) if 'uid' in e else "",
-                "cn": str(e.cn) if 'cn' in e else "",
-                "mail": str(e.mail) if 'mail' in e else ""
-            })
+        seen = set()
+        truncated = False
+        for search_filter in stages:
+            conn.search(
+                search_base=BASE_DN,
+                search_filter=search_filter,
+                search_scope=SUBTREE,
+                attributes=['uid', 'cn', 'mail'],
+                size_limit=limit,
+                time_limit=SEARCH_TIME_LIMIT
+            )
+            truncated = conn.result.get('description') in ('sizeLimitExceeded', 'timeLimitExceeded')
+            for e in conn.entries:
+                if e.entry_dn in seen:
+                    continue
+                seen.add(e.entry_dn)
+                results.append({
+                    "dn": e.entry_dn,
+                    "uid": str(e.uid) if 'uid' in e else "",
+                    "cn": str(e.cn) if 'cn' in e else "",
+                    "mail": str(e.mail) if 'mail' in e else ""
+                })
+            if len(results) >= limit:
+                truncated = True
+                break
 
-        return {"results": results}
+        return {"results": results[:limit], "truncated": truncated}
     
 @app.get("/api/search/groups")
-async def search_groups(
-    name: str = Query(..., description="Group name (cn)"),
-    page_size: int = Query(10, le=1000),
-    cookie: str = None
+def search_groups(
+    name: str = Query(..., min_length=1, description="Group name (cn)"),
+    page_size: int = Query(10, ge=1, le=1000),
+    cookie: str = None,
+    match: str = Query("auto", enum=list(filters.MODES))
 ):
-    decoded_cookie = base64.b64decode(cookie) if cookie else None
-    
+    # auto: prefix matches first, then contains matches that weren't already returned. The
+    # cookie carries the stage (first byte) ahead of the server's paged-results cookie.
+    stage, decoded_cookie = 0, None
+    if cookie:
+        raw = base64.b64decode(cookie)
+        if raw:
+            stage, decoded_cookie = raw[0], raw[1:] or None
+
     with get_conn() as conn:
-        conn.search(
-            search_base=BASE_DN,
-            # Broaden filter to catch both types of groups
-            search_filter=f"(|(objectClass=groupOfNames)(objectClass=posixGroup))(cn=*{name}*)",
-            search_scope=SUBTREE,
-            # CRITICAL: Tell LDAP to return these fields
-            attributes=['cn', 'description', 'gidNumber', 'member', 'memberUid'],
-            paged_size=page_size,
-            paged_cookie=decoded_cookie
-        )
-        
+        schema = conn.server.schema
+        try:
+            stages = planner.stages(['cn'], name, schema) if match == "auto" \
+                else [planner.match(['cn'], name, match, schema)]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         results = []
-        for e in conn.entries:
-            # Handle list attributes safely
-            members = e.member.values if 'member' in e else []
-            posix_members = e.memberUid.values if 'memberUid' in e else []
-            
-            results.append({
-                "dn": e.entry_dn,
-                "cn": e.cn.value,
-                "description": e.description.value if 'description' in e else "",
-                "gidNumber": e.gidNumber.value if 'gidNumber' in e else None,
-                "type": "posix" if 'posixGroup' in e.objectClass else "non-posix",
-                # Combine both just in case, or keep separate for UI
-                "members": members + posix_members, 
-                "memberCount": len(members) + len(posix_members)
-            })
+        resp_cookie = None
+        while stage < len(stages) and len(results) < page_size:
+            # Earlier stages are excluded so every group is returned exactly once
+            search_filter = filters.and_(filters.is_group(), stages[stage],
+                                         *(filters.not_(f) for f in stages[:stage]))
+            conn.search(
+                search_base=BASE_DN,
+                search_filter=search_filter,
+                search_scope=SUBTREE,
+                time_limit=SEARCH_TIME_LIMIT,
+                # CRITICAL: Tell LDAP to return these fields
+                attributes=['objectClass', 'cn', 'description', 'gidNumber', 'member', 'memberUid'],
+                paged_size=page_size - len(results),
+                paged_cookie=decoded_cookie
+            )
 
-        # Cookie logic remains the same
-        controls = conn.result.get('controls', {})
-        paged_control = controls.get('1.2.840.113556.1.4.319', {})
-        resp_cookie = paged_control.get('value', {}).get('cookie')
-        new_cookie = base64.b64encode(resp_cookie).decode('utf-8') if resp_cookie else None
+            for e in conn.entries:
+                # Handle list attributes safely
+                members = e.member.values if 'member' in e else []
+                posix_members = e.memberUid.values if 'memberUid' in e else []
+
+                results.append({
+                    "dn": e.entry_dn,
+                    "cn": e.cn.value,
+                    "description": e.description.value if 'description' in e else "",
+                    "gidNumber": e.gidNumber.value if 'gidNumber' in e else None,
+                    "type": "posix" if 'posixGroup' in e.objectClass else "non-posix",
+                    # Combine both just in case, or keep separate for UI
+                    "members": members + posix_members,
+                    "memberCount": len(members) + len(posix_members)
+                })
+
+            controls = conn.result.get('controls', {})
+            paged_control = controls.get('1.2.840.113556.1.4.319', {})
+            resp_cookie = paged_control.get('value', {}).get('cookie')
+            if resp_cookie:
+                break
+            stage, decoded_cookie = stage + 1, None
+
+        if resp_cookie:
+            new_cookie = base64.b64encode(bytes([stage]) + resp_cookie).decode('utf-8')
+        elif stage < len(stages):
+            new_cookie = base64.b64encode(bytes([stage])).decode('utf-8')
+        else:
+            new_cookie = None
+        metrics.track_paging(cookie, new_cookie)
 
         return {
             "results": results,
             "next_cookie": new_cookie
         }
         
+def delete_group_op(conn, group_cn: str):
+    # 1. Search for the group to get its full DN
+    # Exact, indexed CN match restricted to group entries (never a user that shares the cn)
+    search_filter = filters.and_(filters.is_group(), filters.eq("cn", group_cn))
+    conn.search(BASE_DN, search_filter, size_limit=2)
+
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    group_dn = conn.entries[0].entry_dn
+
+    # 2. Attempt to delete using the full DN
+    if not conn.delete(group_dn):
+        error_desc = conn.result.get('description', 'Unknown LDAP error')
+        # If the error is 'notAllowedOnNonLeaf', it means there are child entries 
+        # (rare for groups, but possible in some DIT structures)
+        raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
+
+    event_bus.publish("delete", group_dn)
+    return {"message": f"Group {group_cn} deleted successfully"}
+
 @app.delete("/api/groups/{group_cn}")
-async def delete_group(group_cn: str, admin: str = Depends(validate_admin)):
+def delete_group(group_cn: str, admin: str = Depends(validate_admin)):
     with get_conn() as conn:
-        # 1. Search for the group to get its full DN
-        # We use a filter to find the exact CN
-        search_filter = f"(&(objectClass=*)(cn={group_cn}))"
-        conn.search(BASE_DN, search_filter)
-        
-        if not conn.entries:
-            raise HTTPException(status_code=404, detail="Group not found")
-        
-        group_dn = conn.entries[0].entry_dn
-        
-        # 2. Attempt to delete using the full DN
-        if not conn.delete(group_dn):
-            error_desc = conn.result.get('description', 'Unknown LDAP error')
-            # If the error is 'notAllowedOnNonLeaf', it means there are child entries 
-            # (rare for groups, but possible in some DIT structures)
-            raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
-            
-        return {"message": f"Group {group_cn} deleted successfully"}
+        return delete_group_op(conn, group_cn)
+
         
 @app.get("/api/users/{username}/groups")
-async def get_user_groups(username: str):
+def get_user_groups(username: str):
     """
     Find all groups a user belongs to. 
     Uses the 'memberOf' operational attribute if enabled, 
@@ -585,89 +1179,155 @@ async def get_user_groups(username: str):
     user_dn = f"uid={username},ou=users,{BASE_DN}"
     with get_conn() as conn:
         # Strategy A: Check 'memberOf' on the user object (Fastest)
-        conn.search(BASE_DN, f'(uid={username})', attributes=['memberOf'])
+        conn.search(BASE_DN, filters.eq("uid", username), attributes=['memberOf'])
         if conn.entries and 'memberOf' in conn.entries[0]:
             return {"groups": conn.entries[0].memberOf.values}
         
         # Strategy B: Fallback - Search groups where user is a member
-        conn.search(BASE_DN, f'(&(objectClass=groupOfNames)(member={user_dn}))', attributes=['cn'])
+        conn.search(BASE_DN, filters.and_(filters.eq("objectClass", "groupOfNames"), filters.eq("member", user_dn)),
+                    attributes=['cn'])
         return {"groups": [e.cn.value for e in conn.entries]}
     
 @app.get("/api/groups/{group_name}")
-async def get_group_details(group_name: str, page_size: int = 50, cookie: str = None):
-    """Fetch group info and its members with pagination."""
+def get_group_details(group_name: str, request: Request, response: Response, page_size: int = 50, cookie: str = None):
+    """Fetch group info and its members with pagination. Supports If-None-Match / If-Modified-Since."""
     group_dn = f"cn={group_name},ou=groups,{BASE_DN}"
     decoded_cookie = base64.b64decode(cookie) if cookie else None
     
     with get_conn() as conn:
+        version_attrs = supported_attrs(conn, VERSION_ATTRS)
+        if has_validators(request) and version_attrs:
+            # Revalidating a huge group must not pull its whole member list
+            conn.search(group_dn, '(objectClass=*)', search_scope=BASE, attributes=version_attrs)
+            if conn.entries:
+                entry = conn.entries[0]
+                etag = entry_etag(entry)
+                if etag and is_not_modified(request, etag, entry_last_modified(entry)):
+                    return not_modified_response(etag, entry_last_modified(entry))
+
         # Fetch group attributes
-        conn.search(group_dn, '(objectClass=*)', attributes=['*'])
+        conn.search(group_dn, '(objectClass=*)', attributes=['*'] + version_attrs)
         if not conn.entries: raise HTTPException(status_code=404, detail="Group not found")
+        entry = conn.entries[0]
         
         # Note: In massive groups, 'member' is a list that can be huge.
         # This is where pagination on the attribute level (Attr-Range) helps,
         # but for now, we'll return the standard attributes.
-        return {
-            "details": conn.entries[0].entry_attributes_as_dict,
+        payload = {
+            "details": entry_payload(entry),
             "dn": group_dn
         }
+        return conditional_payload(request, response, payload, entry_etag(entry), entry_last_modified(entry))
         
-@app.get("/api/tree")
-def get_ldap_tree():
-    try:
-        with get_conn() as conn:
-            # 1. Added 'top' to catch the root entry itself
-            search_filter = '(|(objectClass=organizationalUnit)(objectClass=domain)(objectClass=organization)(objectClass=top)(objectClass=inetOrgPerson))'
-            
-            conn.search(
-                search_base=BASE_DN, 
-                search_filter=search_filter,
-                search_scope='SUBTREE',
-                attributes=['ou', 'dc', 'cn', 'objectClass']
-            )
+# --- TREE CACHE ---
+# The tree is one full subtree scan; the last build is kept and reused while the directory's
+# version (contextCSN) is unchanged. Without contextCSN it is reused for TREE_CACHE_TTL seconds
+# unless the change feed reports an add, delete or rename first.
+TREE_CACHE_TTL = float(os.getenv("TREE_CACHE_TTL", "30"))
+_tree_cache = {"etag": None, "tree": None, "built_at": 0.0, "generation": -1}
+_tree_generation = 0
+
+def _bump_tree_generation(event):
+    global _tree_generation
+    if event["action"] in ("add", "delete", "rename"):
+        _tree_generation += 1
+
+event_bus.add_listener(_bump_tree_generation)
+
+def tree_version(conn):
+    # contextCSN on the suffix moves on every write anywhere below it (syncprov), so it
+    # validates the whole tree with a single base-scope read
+    if supported_attrs(conn, ['contextCSN']):
+        conn.search(BASE_DN, '(objectClass=*)', search_scope=BASE, attributes=['contextCSN'])
+        if conn.entries and 'contextCSN' in conn.entries[0]:
+            context_csn = sorted(conn.entries[0].contextCSN.values)
+            if context_csn:
+                return f'"{hashlib.sha1("|".join(context_csn).encode()).hexdigest()[:20]}"'
+    return None
+
+def build_tree(conn):
+    # 1. Added 'top' to catch the root entry itself
+    search_filter = '(|(objectClass=organizationalUnit)(objectClass=domain)(objectClass=organization)(objectClass=top)(objectClass=inetOrgPerson))'
+    
+    conn.search(
+        search_base=BASE_DN, 
+        search_filter=search_filter,
+        search_scope='SUBTREE',
+        attributes=['ou', 'dc', 'cn', 'objectClass']
+    )
+
+    flat_map = {}
+    user_counts = {}
+
+    for entry in conn.entries:
+        dn = entry.entry_dn
+        is_user = 'inetOrgPerson' in entry.objectClass
         
-            flat_map = {}
-            user_counts = {}
-
-            for entry in conn.entries:
-                dn = entry.entry_dn
-                is_user = 'inetOrgPerson' in entry.objectClass
-                
-                # Check for 10 user limit
-                if is_user:
-                    parent_dn = dn.split(',', 1)[1] if ',' in dn else 'root'
-                    user_counts[parent_dn] = user_counts.get(parent_dn, 0) + 1
-                    if user_counts[parent_dn] > 10:
-                        continue
-
-                # Label Logic
-                label = (getattr(entry, 'ou', None) or 
-                         getattr(entry, 'dc', None) or 
-                         getattr(entry, 'cn', None) or 
-                         dn.split('=')[1].split(',')[0])
+        # Check for 10 user limit
+        if is_user:
+            parent_dn = dn.split(',', 1)[1] if ',' in dn else 'root'
+            user_counts[parent_dn] = user_counts.get(parent_dn, 0) + 1
+            if user_counts[parent_dn] > 10:
+                continue
+
+        # Label Logic
+        label = (getattr(entry, 'ou', None) or 
+                 getattr(entry, 'dc', None) or 
+                 getattr(entry, 'cn', None) or 
+                 dn.split('=')[1].split(',')[0])
+
+        flat_map[dn] = {
+            "title": str(label),
+            "key": dn,
+            "children": [],
+            "isLeaf": is_user,
+            "selectable": True
+        }
 
-                flat_map[dn] = {
-                    "title": str(label),
-                    "key": dn,
-                    "children": [],
-                    "isLeaf": is_user,
-                    "selectable": True
-                }
+    # 2. Build the hierarchy
+    tree = []
+    for dn, node in flat_map.items():
+        parts = dn.split(',', 1)
+        parent_dn = parts[1] if len(parts) > 1 else None
+        
+        # IMPORTANT: Only link to parent if parent is actually in our map
+        if parent_dn and parent_dn in flat_map:
+            flat_map[parent_dn]["children"].append(node)
+        else:
+            # If this is the highest level we found, it becomes a root
+            tree.append(node)
+    
+    return tree
+
+def cached_tree(conn, tree_etag):
+    cache = _tree_cache
+    if cache["tree"] is not None:
+        if tree_etag is not None and cache["etag"] == tree_etag:
+            metrics.record_cache("tree", True)
+            return cache["tree"]
+        if (tree_etag is None and cache["etag"] is None and cache["generation"] == _tree_generation
+                and time.monotonic() - cache["built_at"] < TREE_CACHE_TTL):
+            metrics.record_cache("tree", True)
+            return cache["tree"]
+    metrics.record_cache("tree", False)
+    generation = _tree_generation
+    tree = build_tree(conn)
+    cache.update(etag=tree_etag, tree=tree, built_at=time.monotonic(), generation=generation)
+    return tree
+
+def prime_tree_cache():
+    with get_conn() as conn:
+        cached_tree(conn, tree_version(conn))
 
-            # 2. Build the hierarchy
-            tree = []
-            for dn, node in flat_map.items():
-                parts = dn.split(',', 1)
-                parent_dn = parts[1] if len(parts) > 1 else None
-                
-                # IMPORTANT: Only link to parent if parent is actually in our map
-                if parent_dn and parent_dn in flat_map:
-                    flat_map[parent_dn]["children"].append(node)
-                else:
-                    # If this is the highest level we found, it becomes a root
-                    tree.append(node)
-            
-            return tree
+@app.get("/api/tree")
+def get_ldap_tree(request: Request, response: Response):
+    try:
+        with get_conn() as conn:
+            tree_etag = tree_version(conn)
+            if tree_etag and is_not_modified(request, tree_etag):
+                return not_modified_response(tree_etag)
+            tree = cached_tree(conn, tree_etag)
+            return conditional_payload(request, response, tree, tree_etag)
     except Exception as e:
         return {"error": str(e)}
     try:
@@ -933,84 +1593,94 @@ def get_ldap_tree():
         # This will now catch the error and show it in your frontend if it still persists
         return {"error": str(e)}
 
-@app.post("/api/groups/add-member")
-async def add_user_to_group(payload: dict, admin: str = Depends(validate_admin)):
+def add_user_to_group_op(conn, payload: dict):
     group_dn = payload.get("group_dn")
     user_dn = payload.get("user_dn")
     username = payload.get("username")
 
+    # 1. First, let's see what this group actually is
+    conn.search(group_dn, '(objectClass=*)', attributes=['objectClass'])
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    group_classes = conn.entries[0].objectClass.value
+    changes = {}
+
+    # 2. Add 'member' if it's a standard group
+    if 'groupOfNames' in group_classes or 'groupOfUniqueNames' in group_classes:
+        changes['member'] = [(MODIFY_ADD, [user_dn])]
+
+    # 3. Add 'memberUid' if it's a POSIX group
+    if 'posixGroup' in group_classes:
+        changes['memberUid'] = [(MODIFY_ADD, [username])]
+
+    if not changes:
+         # Fallback: try adding to 'member' if we can't detect type
+         changes['member'] = [(MODIFY_ADD, [user_dn])]
+
+    # 4. Perform the modification
+    if not conn.modify(group_dn, changes):
+        error_desc = conn.result.get('description', 'Unknown error')
+        # If we get objectClassViolation here, it's because we tried to add 
+        # an attribute the group doesn't support.
+        raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
+
+    event_bus.publish("membership", group_dn, added=1, removed=0, member=username or user_dn)
+    return {"message": f"Successfully added {username} to group"}
+
+@app.post("/api/groups/add-member")
+def add_user_to_group(payload: dict, admin: str = Depends(validate_admin)):
     with get_conn() as conn:
-        # 1. First, let's see what this group actually is
-        conn.search(group_dn, '(objectClass=*)', attributes=['objectClass'])
-        if not conn.entries:
-            raise HTTPException(status_code=404, detail="Group not found")
-        
-        group_classes = conn.entries[0].objectClass.value
-        changes = {}
+        return add_user_to_group_op(conn, payload)
 
-        # 2. Add 'member' if it's a standard group
-        if 'groupOfNames' in group_classes or 'groupOfUniqueNames' in group_classes:
-            changes['member'] = [(MODIFY_ADD, [user_dn])]
-        
-        # 3. Add 'memberUid' if it's a POSIX group
-        if 'posixGroup' in group_classes:
-            changes['memberUid'] = [(MODIFY_ADD, [username])]
-
-        if not changes:
-             # Fallback: try adding to 'member' if we can't detect type
-             changes['member'] = [(MODIFY_ADD, [user_dn])]
-
-        # 4. Perform the modification
-        if not conn.modify(group_dn, changes):
-            error_desc = conn.result.get('description', 'Unknown error')
-            # If we get objectClassViolation here, it's because we tried to add 
-            # an attribute the group doesn't support.
-            raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
-
-        return {"message": f"Successfully added {username} to group"}
     
-@app.post("/api/groups/remove-member")
-async def remove_user_from_group(payload: dict, admin: str = Depends(validate_admin)):
+def remove_user_from_group_op(conn, payload: dict):
     group_dn = payload.get("group_dn")
     user_dn = payload.get("user_dn")
     username = payload.get("username")
 
-    with get_conn() as conn:
-        # 1. Fetch the group to see what attributes it supports
-        conn.search(group_dn, '(objectClass=*)', attributes=['objectClass', 'member', 'memberUid'])
-        if not conn.entries:
-            raise HTTPException(status_code=404, detail="Group not found")
-        
-        entry = conn.entries[0]
-        group_classes = entry.objectClass.value
-        changes = {}
+    # 1. Fetch the group to see what attributes it supports
+    conn.search(group_dn, '(objectClass=*)', attributes=['objectClass', 'member', 'memberUid'])
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="Group not found")
 
-        # 2. If it's a Standard Group, remove the Full DN from 'member'
-        if 'groupOfNames' in group_classes or 'groupOfUniqueNames' in group_classes:
-            if 'member' in entry and user_dn in entry.member.values:
-                changes['member'] = [(MODIFY_DELETE, [user_dn])]
-        
-        # 3. If it's a POSIX Group, remove the Username from 'memberUid'
-        if 'posixGroup' in group_classes:
-            if 'memberUid' in entry and username in entry.memberUid.values:
-                changes['memberUid'] = [(MODIFY_DELETE, [username])]
+    entry = conn.entries[0]
+    group_classes = entry.objectClass.value
+    changes = {}
+
+    # 2. If it's a Standard Group, remove the Full DN from 'member'
+    if 'groupOfNames' in group_classes or 'groupOfUniqueNames' in group_classes:
+        if 'member' in entry and user_dn in entry.member.values:
+            changes['member'] = [(MODIFY_DELETE, [user_dn])]
+
+    # 3. If it's a POSIX Group, remove the Username from 'memberUid'
+    if 'posixGroup' in group_classes:
+        if 'memberUid' in entry and username in entry.memberUid.values:
+            changes['memberUid'] = [(MODIFY_DELETE, [username])]
+
+    if not changes:
+        raise HTTPException(status_code=400, detail="User not found in any supported group attributes")
 
-        if not changes:
-            raise HTTPException(status_code=400, detail="User not found in any supported group attributes")
+    # 4. Apply the deletion
+    if not conn.modify(group_dn, changes):
+        error_desc = conn.result.get('description', 'Unknown error')
+        raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
 
-        # 4. Apply the deletion
-        if not conn.modify(group_dn, changes):
-            error_desc = conn.result.get('description', 'Unknown error')
-            raise HTTPException(status_code=400, detail=f"LDAP Error: {error_desc}")
+    event_bus.publish("membership", group_dn, added=0, removed=1, member=username or user_dn)
+    return {"message": f"Successfully removed {username} from group"}
+
+@app.post("/api/groups/remove-member")
+def remove_user_from_group(payload: dict, admin: str = Depends(validate_admin)):
+    with get_conn() as conn:
+        return remove_user_from_group_op(conn, payload)
 
-        return {"message": f"Successfully removed {username} from group"}
         
 @app.get("/api/groups/{group_cn}/members")
-async def get_group_members(group_cn: str, admin: str = Depends(validate_admin)):
+def get_group_members(group_cn: str, admin: str = Depends(validate_admin)):
     with get_conn() as conn:
         # Search for the specific group to get its member list
-        search_filter = f"(&(objectClass=*)(cn={group_cn}))"
-        conn.search(BASE_DN, search_filter, attributes=['member', 'memberUid'])
+        search_filter = filters.and_(filters.is_group(), filters.eq("cn", group_cn))
+        conn.search(BASE_DN, search_filter, attributes=['member', 'memberUid'], size_limit=2)
         
         if not conn.entries:
             return {"members": []}
@@ -1019,4 +1689,722 @@ async def get_group_members(group_cn: str, admin: str = Depends(validate_admin))
         # Merge member (DNs) and memberUid (Usernames)
         m1 = entry.member.values if 'member' in entry else []
         m2 = entry.memberUid.values if 'memberUid' in entry else []
-        return {"members": m1 + m2}
\ No newline at end of file
+        return {"members": m1 + m2}
+# Values per MODIFY when syncing membership; keeps each request well under slapd's PDU limits
+GROUP_SYNC_BATCH_SIZE = int(os.getenv("GROUP_SYNC_BATCH_SIZE", "1000"))
+
+def _normalize_dn(dn: str):
+    return ",".join(part.strip() for part in dn.split(",")).lower()
+
+def _member_identity(value: str):
+    """Accepts a username or a user DN; returns (uid, dn)."""
+    if "=" in value:
+        first_rdn = value.split(",", 1)[0]
+        attr, _, rdn_value = first_rdn.partition("=")
+        uid = rdn_value.strip() if attr.strip().lower() == "uid" else None
+        return uid, value.strip()
+    return value.strip(), f"uid={value.strip()},ou=users,{BASE_DN}"
+
+def _chunks(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def replace_group_members_op(conn, group_cn: str, members: list, dry_run: bool = False):
+    group_dn = f"cn={group_cn},ou=groups,{BASE_DN}"
+
+    desired_dns = {}
+    desired_uids = set()
+    for value in members:
+        if not value or not value.strip():
+            continue
+        uid, dn = _member_identity(value)
+        desired_dns[_normalize_dn(dn)] = dn
+        if uid:
+            desired_uids.add(uid)
+
+    # 1. One read of the group: its type and current membership
+    conn.search(group_dn, '(objectClass=*)', search_scope=BASE, attributes=['objectClass', 'member', 'memberUid'])
+    if not conn.entries:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    entry = conn.entries[0]
+    group_classes = entry.objectClass.values
+    uses_member = 'groupOfNames' in group_classes or 'groupOfUniqueNames' in group_classes
+    uses_member_uid = 'posixGroup' in group_classes
+
+    # 2. Compute the diff per attribute
+    adds = {}
+    deletes = {}
+    unchanged = 0
+    if uses_member:
+        current = {_normalize_dn(dn): dn for dn in (entry.member.values if 'member' in entry else [])}
+        adds['member'] = [desired_dns[k] for k in sorted(desired_dns.keys() - current.keys())]
+        deletes['member'] = [current[k] for k in sorted(current.keys() - desired_dns.keys())]
+        unchanged = max(unchanged, len(current.keys() & desired_dns.keys()))
+    if uses_member_uid:
+        current_uids = set(entry.memberUid.values if 'memberUid' in entry else [])
+        adds['memberUid'] = sorted(desired_uids - current_uids)
+        deletes['memberUid'] = sorted(current_uids - desired_uids)
+        unchanged = max(unchanged, len(current_uids & desired_uids))
+
+    summary = {
+        "group": group_dn,
+        "added": {attr: len(v) for attr, v in adds.items()},
+        "removed": {attr: len(v) for attr, v in deletes.items()},
+        "unchanged": unchanged,
+    }
+    if dry_run:
+        return {**summary, "dry_run": True, "to_add": adds, "to_remove": deletes}
+
+    # 3. Apply: all adds before deletes so a groupOfNames is never left empty mid-sync
+    operations = 0
+    for mod_type, diff in ((MODIFY_ADD, adds), (MODIFY_DELETE, deletes)):
+        batches = {attr: list(_chunks(values, GROUP_SYNC_BATCH_SIZE)) for attr, values in diff.items() if values}
+        for i in range(max((len(b) for b in batches.values()), default=0)):
+            changes = {attr: [(mod_type, b[i])] for attr, b in batches.items() if i < len(b)}
+            if not conn.modify(group_dn, changes):
+                error_desc = conn.result.get('description', 'Unknown error')
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"LDAP Error after {operations} modify operations: {error_desc}"
+                )
+            operations += 1
+
+    if operations:
+        event_bus.publish("membership", group_dn,
+                          added=max(summary["added"].values(), default=0),
+                          removed=max(summary["removed"].values(), default=0))
+    return {**summary, "modify_operations": operations}
+
+@app.put("/api/groups/{group_cn}/members")
+def replace_group_members(
+    group_cn: str,
+    members: list[str] = Body(..., embed=True),
+    dry_run: bool = Query(False),
+    admin: str = Depends(validate_admin)
+):
+    """
+    Make the group's membership exactly `members` (usernames or user DNs).
+    Reads the group once, diffs against current membership and applies only the
+    difference, in batched MODIFYs covering both 'member' and 'memberUid'.
+    """
+    with get_conn() as conn:
+        return replace_group_members_op(conn, group_cn, members, dry_run)
+
+
+# --- BATCH API ---
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "500"))
+
+# op name -> callable(conn, args). Arguments mirror the single-operation routes' bodies.
+BATCH_OPERATIONS = {
+    "add_user": lambda conn, args: add_user_op(conn, args),
+    "update_user": lambda conn, args: update_user_op(conn, args["uid"], args.get("updates", {})),
+    "delete_user": lambda conn, args: delete_user_op(conn, args["uid"]),
+    "disable_user": lambda conn, args: disable_user_op(conn, args["username"]),
+    "reset_password": lambda conn, args: reset_password_op(conn, args["username"], args["new_password"]),
+    "add_member": lambda conn, args: add_user_to_group_op(conn, args),
+    "remove_member": lambda conn, args: remove_user_from_group_op(conn, args),
+    "set_members": lambda conn, args: replace_group_members_op(
+        conn, args["group_cn"], args.get("members", []), args.get("dry_run", False)),
+    "create_group": lambda conn, args: create_group_op(
+        conn, args["name"], args.get("description"), args.get("group_type", "posix"), args.get("gid")),
+    "update_group": lambda conn, args: update_group_op(conn, args["group_cn"], args.get("description"), args.get("gid")),
+    "delete_group": lambda conn, args: delete_group_op(conn, args["group_cn"]),
+}
+
+# op name -> {arg: (accepted types, required)}; every op is checked before any of them runs,
+# so a malformed batch is rejected whole instead of failing halfway through
+BATCH_ARGS = {
+    "add_user": {"username": (str, True), "last_name": (str, True), "first_name": (str, False),
+                 "password": (str, True), "mail": (str, False), "base_dn": (str, False), "gid": ((int, str), False)},
+    "update_user": {"uid": (str, True), "updates": (dict, False)},
+    "delete_user": {"uid": (str, True)},
+    "disable_user": {"username": (str, True)},
+    "reset_password": {"username": (str, True), "new_password": (str, True)},
+    "add_member": {"group_dn": (str, True), "user_dn": (str, False), "username": (str, False)},
+    "remove_member": {"group_dn": (str, True), "user_dn": (str, False), "username": (str, False)},
+    "set_members": {"group_cn": (str, True), "members": (List[str], False), "dry_run": (bool, False)},
+    "create_group": {"name": (str, True), "description": (str, False), "group_type": (str, False), "gid": (int, False)},
+    "update_group": {"group_cn": (str, True), "description": (str, False), "gid": (int, False)},
+    "delete_group": {"group_cn": (str, True)},
+}
+
+def _batch_arg_errors(operation: dict):
+    args = operation.get("args") or {}
+    if not isinstance(args, dict):
+        return ["args must be an object"]
+    errors = []
+    for name, (types, required) in BATCH_ARGS[operation["op"]].items():
+        value = args.get(name)
+        if value is None:
+            if required:
+                errors.append(f"missing '{name}'")
+        elif get_origin(types) is list:
+            item_type = get_args(types)[0]
+            if not isinstance(value, list) or not all(isinstance(v, item_type) for v in value):
+                errors.append(f"'{name}' must be a list of {item_type.__name__}")
+        elif not isinstance(value, types) or (types is int and isinstance(value, bool)):
+            errors.append(f"'{name}' has the wrong type")
+    return errors
+
+@app.post("/api/batch")
+def run_batch(
+    operations: List[dict] = Body(..., embed=True),
+    stop_on_error: bool = Body(True, embed=True),
+    admin: str = Depends(validate_admin)
+):
+    """
+    Run an ordered list of operations, e.g.
+      {"operations": [{"op": "add_user", "args": {...}}, {"op": "add_member", "args": {...}}]}
+    Authorizes once and executes everything on one pooled connection. With stop_on_error,
+    the first failure marks the remaining operations as skipped.
+    """
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    unknown = [i for i, o in enumerate(operations) if o.get("op") not in BATCH_OPERATIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown op at index {unknown}; supported: {', '.join(BATCH_OPERATIONS)}"
+        )
+    invalid = {i: errors for i, o in enumerate(operations) if (errors := _batch_arg_errors(o))}
+    if invalid:
+        raise HTTPException(status_code=400, detail={"invalid_arguments": invalid})
+
+    results = []
+    halted = None
+    try:
+        with get_conn() as conn:
+            for index, operation in enumerate(operations):
+                op_name = operation["op"]
+                if halted:
+                    results.append({"index": index, "op": op_name, "status": "skipped", "detail": halted})
+                    continue
+                try:
+                    result = BATCH_OPERATIONS[op_name](conn, operation.get("args") or {})
+                    results.append({"index": index, "op": op_name, "status": "ok", "result": result})
+                    continue
+                except HTTPException as e:
+                    results.append({"index": index, "op": op_name, "status": "error",
+                                    "status_code": e.status_code, "detail": e.detail})
+                except KeyError as e:
+                    results.append({"index": index, "op": op_name, "status": "error",
+                                    "status_code": 400, "detail": f"Missing argument: {e.args[0]}"})
+                except LDAPException as e:
+                    # The shared connection itself failed; nothing after this can run on it.
+                    # Re-raised so get_conn discards the connection instead of pooling it.
+                    print(f"BATCH LDAP Error at {index}: {e}")
+                    results.append({"index": index, "op": op_name, "status": "error",
+                                    "status_code": 500, "detail": f"LDAP Error: {e}"})
+                    halted = f"Connection failed at operation {index}"
+                    results.extend({"index": i, "op": o["op"], "status": "skipped", "detail": halted}
+                                   for i, o in enumerate(operations[index + 1:], index + 1))
+                    raise
+                except Exception as e:
+                    # Unexpected failure: report it in place so the caller still sees what committed
+                    print(f"BATCH Error at {index}: {e}")
+                    results.append({"index": index, "op": op_name, "status": "error",
+                                    "status_code": 500, "detail": f"Internal error: {e}"})
+                    halted = f"Stopped after internal error at operation {index}"
+                    continue
+                if stop_on_error:
+                    halted = f"Stopped after error at operation {index}"
+    except LDAPException:
+        pass  # already reported in `results`
+
+    return {
+        "results": results,
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] == "error"),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+    }
+
+# --- CHANGE FEED API ---
+def _csv(value: str):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+def _sse(event):
+    lines = [] if event["id"] is None else [f"id: {event['id']}"]
+    lines += [f"event: {event['action']}", f"data: {json.dumps(event)}"]
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/api/events")
+async def stream_events(
+    request: Request,
+    types: str = Query(None, description="Comma-separated: user,group,entry"),
+    actions: str = Query(None, description="Comma-separated: add,modify,delete,rename,membership"),
+    base: str = Query(None, description="Only entries at or below this DN"),
+    access_token: str = Query(None),
+    token: str = Depends(optional_oauth2_scheme)
+):
+    """
+    Server-Sent Events stream of directory changes, so dashboards refresh only what changed
+    instead of polling the list/tree endpoints. Reconnects resume from Last-Event-ID; a
+    `resync` event means events were missed and the client should refetch.
+    """
+    await get_current_user(token or access_token or "")
+
+    bad = [a for a in (_csv(actions) or []) if a not in ACTIONS]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Unknown actions: {', '.join(bad)}")
+
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    try:
+        sub = event_bus.subscribe(_csv(types), _csv(actions), base, last_event_id)
+    except TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                event = await sub.next(EVENTS_HEARTBEAT)
+                yield ": keepalive\n\n" if event is None else _sse(event)
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- BACKGROUND JOBS ---
+def _validate_subtree_params(params: dict):
+    base_dn = (params.get("base_dn") or "").strip()
+    if not base_dn:
+        raise HTTPException(status_code=400, detail="params.base_dn is required")
+    base, root = _normalize_dn(base_dn), _normalize_dn(BASE_DN)
+    if base == root or not base.endswith("," + root):
+        raise HTTPException(status_code=400, detail=f"base_dn must be strictly below {BASE_DN}")
+
+def _expand_subtree(conn, params: dict):
+    """Every DN at or below base_dn, deepest first, so children are deleted before parents."""
+    base_dn = params["base_dn"]
+    dns = []
+    conn.search(base_dn, '(objectClass=*)', search_scope=SUBTREE, attributes=['1.1'], paged_size=1000)
+    while True:
+        dns.extend(e.entry_dn for e in conn.entries)
+        cookie = conn.result.get('controls', {}).get('1.2.840.113556.1.4.319', {}).get('value', {}).get('cookie')
+        if not cookie:
+            break
+        conn.search(base_dn, '(objectClass=*)', search_scope=SUBTREE, attributes=['1.1'],
+                    paged_size=1000, paged_cookie=cookie)
+    return sorted(dns, key=lambda dn: dn.count(','), reverse=True)
+
+def _delete_entry(conn, dn: str):
+    if not conn.delete(dn):
+        error_desc = conn.result.get('description', 'Unknown Error')
+        if error_desc == 'noSuchObject':
+            return  # already gone (e.g. resumed after a restart)
+        raise HTTPException(status_code=400, detail=f"Failed to delete: {error_desc}")
+    event_bus.publish("delete", dn)
+
+job_manager = JobManager(
+    ldap_pool.lease,
+    kinds={
+        "disable_users": JobKind(lambda conn, username: disable_user_op(conn, username)),
+        "delete_users": JobKind(lambda conn, uid: delete_user_op(conn, uid)),
+        "reset_passwords": JobKind(
+            lambda conn, item: reset_password_op(conn, item["username"], item["new_password"]),
+            secret="new_password"),
+        "delete_subtree": JobKind(_delete_entry, expand=_expand_subtree, validate=_validate_subtree_params),
+    },
+    store_dir=os.path.join(DATA_DIR, "jobs"),
+    workers=int(os.getenv("JOB_WORKERS", "2")),
+    rate=float(os.getenv("JOB_RATE_PER_SECOND", "50")),
+    max_items=int(os.getenv("JOB_MAX_ITEMS", "100000")),
+    retention_hours=float(os.getenv("JOB_RETENTION_HOURS", "72")),
+)
+
+@app.on_event("startup")
+def start_job_workers():
+    if IS_CONFIGURED:
+        job_manager.start()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_manager.stop()
+
+@app.post("/api/jobs", status_code=202)
+def submit_job(
+    kind: str = Body(..., embed=True),
+    items: list = Body(None, embed=True),
+    params: dict = Body(None, embed=True),
+    admin: str = Depends(validate_admin)
+):
+    """
+    Queue a bulk operation and return its job id immediately. Kinds:
+      disable_users / delete_users: items are usernames
+      reset_passwords: items are {"username", "new_password"} (passwords are kept in memory only)
+      delete_subtree: params {"base_dn"}; every entry below it is deleted, leaves first
+    """
+    return job_manager.submit(kind, items, params, created_by=admin)
+
+@app.get("/api/jobs")
+async def list_jobs(admin: str = Depends(validate_admin)):
+    return {"jobs": job_manager.list()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, admin: str = Depends(validate_admin)):
+    return job_manager.describe(job_manager.get(job_id))
+
+@app.get("/api/jobs/{job_id}/failures")
+def get_job_failures(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000),
+                     admin: str = Depends(validate_admin)):
+    return job_manager.failures(job_id, offset, limit)
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, admin: str = Depends(validate_admin)):
+    return job_manager.cancel(job_id)
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(
+    job_id: str,
+    request: Request,
+    access_token: str = Query(None),
+    token: str = Depends(optional_oauth2_scheme)
+):
+    """SSE progress for one job: a `progress` event whenever counters move, then `done`."""
+    # validate_admin may query LDAP; keep its pool wait off the event loop
+    await run_in_threadpool(validate_admin, await get_current_user(token or access_token or ""))
+    job = job_manager.get(job_id)
+
+    async def stream():
+        last = None
+        while not await request.is_disconnected():
+            view = job_manager.describe(job, failures_limit=0)
+            state = (view["status"], view["processed"], view["failed"], view["total"])
+            if view["status"] in FINISHED:
+                yield f"event: done\ndata: {json.dumps(job_manager.describe(job))}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps(view)}\n\n" if state != last else ": keepalive\n\n"
+            last = state
+            await asyncio.sleep(1)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- IN-MEMORY DIRECTORY MODEL ---
+# Compact mirror of users/groups for analytics and set operations; kept current by the change feed
+directory = DirectoryStore()
+event_bus.add_listener(directory.mark_dirty)
+_directory_loading = threading.Lock()
+
+# The model is snapshotted under DATA_DIR; a restart restores the snapshot and catches up with
+# a modifyTimestamp delta search plus a DNs-only delete check instead of re-reading every entry
+DIRECTORY_SNAPSHOT = os.getenv("DIRECTORY_SNAPSHOT", os.path.join(DATA_DIR, "directory.snapshot"))
+DIRECTORY_SNAPSHOT_INTERVAL = float(os.getenv("DIRECTORY_SNAPSHOT_INTERVAL", "300"))
+# Changes this many seconds before a snapshot are re-read on restore (change-feed lag, clock skew)
+DIRECTORY_SNAPSHOT_OVERLAP = float(os.getenv("DIRECTORY_SNAPSHOT_OVERLAP", "300"))
+# Older snapshots are discarded for a full load
+DIRECTORY_SNAPSHOT_MAX_AGE = float(os.getenv("DIRECTORY_SNAPSHOT_MAX_AGE", "86400"))
+# Operational attributes that identify the suffix entry itself, by server flavour
+BASE_ENTRY_IDS = ('entryUUID', 'nsUniqueId', 'objectGUID', 'createTimestamp')
+_snapshot_state = {"path": DIRECTORY_SNAPSHOT or None, "saved_at": None, "saved_version": None,
+                   "bytes": None, "restored": None}
+_snapshot_stop = threading.Event()
+
+def _generalized_time(ts: float):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y%m%d%H%M%SZ')
+
+def directory_fingerprint(conn):
+    """Which directory a snapshot belongs to: server, suffix and the suffix entry's unique id."""
+    base_id = None
+    ids = supported_attrs(conn, BASE_ENTRY_IDS)
+    if ids:
+        conn.search(BASE_DN, '(objectClass=*)', search_scope=BASE, attributes=ids)
+        for name in ids:
+            if conn.entries and name in conn.entries[0] and conn.entries[0][name].value is not None:
+                base_id = f"{name}={conn.entries[0][name].value}"
+                break
+    return {"server": f"{LDAP_HOST}:{LDAP_PORT}", "base_dn": _normalize_dn(BASE_DN), "base_id": base_id}
+
+def save_directory_snapshot(conn):
+    """Applies pending changes, then writes the snapshot if the model changed since the last one."""
+    if not DIRECTORY_SNAPSHOT or not directory.loaded:
+        return False
+    # Taken before the sync, so anything that lands while we write is re-read on restore
+    meta = {"base_dn": BASE_DN, "fingerprint": directory_fingerprint(conn), "context_csn": tree_version(conn),
+            "saved_at": time.time(), "synced_at": _generalized_time(time.time() - DIRECTORY_SNAPSHOT_OVERLAP)}
+    directory.sync(conn)
+    version = directory.version
+    if version == _snapshot_state["saved_version"]:
+        return False
+    os.makedirs(os.path.dirname(DIRECTORY_SNAPSHOT) or ".", exist_ok=True)
+    size = directory.save_snapshot(DIRECTORY_SNAPSHOT, meta)
+    _snapshot_state.update(saved_at=time.time(), saved_version=version, bytes=size)
+    return True
+
+def restore_directory(conn):
+    """Restores the model from its snapshot; None if there is no usable snapshot."""
+    if not DIRECTORY_SNAPSHOT or not os.path.exists(DIRECTORY_SNAPSHOT):
+        return None
+    try:
+        meta = directory.restore(conn, BASE_DN, DIRECTORY_SNAPSHOT, fingerprint=directory_fingerprint(conn),
+                                 max_age=DIRECTORY_SNAPSHOT_MAX_AGE, context_csn=tree_version(conn))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Directory snapshot unusable, doing a full load instead: {e}")
+        return None
+    _snapshot_state["restored"] = meta
+    return meta
+
+def load_directory(prefer_snapshot: bool = False):
+    if not _directory_loading.acquire(blocking=False):
+        return False
+    try:
+        started = time.perf_counter()
+        with ldap_pool.lease() as conn:
+            meta = restore_directory(conn) if prefer_snapshot else None
+            if meta is None:
+                directory.load(conn, BASE_DN)
+            stats = directory.stats()
+            source = (f"restored from snapshot (+{meta['caught_up']} changed, -{meta.get('removed', 0)} deleted)"
+                      if meta else "loaded")
+            print(f"Directory model {source}: {stats['users']} users, {stats['groups']} groups, "
+                  f"~{stats['approx_bytes'] // (1024 * 1024)} MB in {time.perf_counter() - started:.1f}s")
+            save_directory_snapshot(conn)
+        return True
+    except Exception as e:
+        print(f"Directory model load failed: {e}")
+        return False
+    finally:
+        _directory_loading.release()
+
+def _snapshot_loop():
+    while not _snapshot_stop.wait(DIRECTORY_SNAPSHOT_INTERVAL):
+        # A load in progress writes its own snapshot when it finishes. Saving doesn't take
+        # _directory_loading, so reloads aren't refused while a snapshot is written.
+        if _directory_loading.locked():
+            continue
+        try:
+            with ldap_pool.lease() as conn:
+                save_directory_snapshot(conn)
+        except Exception as e:
+            print(f"Directory snapshot failed: {e}")
+
+@app.on_event("startup")
+def start_directory_snapshots():
+    if IS_CONFIGURED and DIRECTORY_SNAPSHOT and DIRECTORY_SNAPSHOT_INTERVAL > 0:
+        threading.Thread(target=_snapshot_loop, name="directory-snapshot", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_directory_snapshots():
+    _snapshot_stop.set()
+
+@app.get("/api/directory/stats")
+async def get_directory_stats(admin: str = Depends(validate_admin)):
+    return {**directory.stats(), "loading": _directory_loading.locked(),
+            "snapshot": {k: v for k, v in _snapshot_state.items() if k != "saved_version"}}
+
+@app.post("/api/directory/reload", status_code=202)
+async def reload_directory(admin: str = Depends(validate_admin)):
+    """Rebuild the in-memory model from a full paged scan, in the background."""
+    if _directory_loading.locked():
+        raise HTTPException(status_code=409, detail="A directory load is already running")
+    threading.Thread(target=load_directory, name="directory-load", daemon=True).start()
+    return {"status": "loading"}
+
+# --- MEMBERSHIP ANALYTICS ---
+# Access-review questions answered from the in-memory model's integer member sets. The routes
+# are plain `def`: the set work is CPU-bound and runs in the threadpool, off the event loop.
+ANALYTICS_MAX_GROUPS = int(os.getenv("ANALYTICS_MAX_GROUPS", "50"))
+
+def current_directory():
+    """The loaded model, with changes from the feed applied; 503 while it is still loading."""
+    if not directory.loaded:
+        raise HTTPException(status_code=503, detail="Directory model is loading", headers={"Retry-After": "10"})
+    if directory.stats()["pending_changes"]:
+        with get_conn() as conn:
+            directory.sync(conn)
+    return directory
+
+def _resolve_groups(names: str, model):
+    names = _csv(names) or []
+    if len(names) > ANALYTICS_MAX_GROUPS:
+        raise HTTPException(status_code=400, detail=f"At most {ANALYTICS_MAX_GROUPS} groups per query")
+    groups = []
+    for name in names:
+        group = model.group(name)
+        if group is None:
+            raise HTTPException(status_code=404, detail=f"Group not found: {name}")
+        groups.append(group)
+    return groups
+
+def _page_of_users(model, rows, offset: int, limit: int):
+    return {
+        "count": len(rows),
+        "offset": offset,
+        "limit": limit,
+        "users": [model.user(r) for r in rows[offset:offset + limit]],
+    }
+
+def _group_summary(group):
+    return {"dn": group.dn, "cn": group.cn, "members": len(group.members), "unresolved_members": len(group.external)}
+
+@app.get("/api/analytics/membership")
+def membership_query(
+    all_of: str = Query(None, description="Members of every one of these groups (intersection)"),
+    any_of: str = Query(None, description="Members of at least one of these groups (union)"),
+    none_of: str = Query(None, description="...and of none of these groups (difference)"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    admin: str = Depends(validate_admin)
+):
+    """
+    Set algebra across groups, e.g. "in admins but not in security-trained":
+      ?all_of=admins&none_of=security-trained
+    """
+    model = current_directory()
+    include_all = _resolve_groups(all_of, model)
+    include_any = _resolve_groups(any_of, model)
+    exclude = _resolve_groups(none_of, model)
+    if not include_all and not include_any:
+        raise HTTPException(status_code=400, detail="Give all_of and/or any_of")
+
+    sets = [g.members for g in include_all]
+    if include_any:
+        sets.append(model.union(*(g.members for g in include_any)))
+    rows = model.intersection(*sets)
+    if exclude:
+        rows = model.difference(rows, *(g.members for g in exclude))
+    return _page_of_users(model, rows, offset, limit)
+
+@app.get("/api/analytics/groups/overlap")
+def group_overlap(groups: str = Query(..., description="Comma-separated group names"),
+                        admin: str = Depends(validate_admin)):
+    """Pairwise shared-member counts and Jaccard similarity for up to ANALYTICS_MAX_GROUPS groups."""
+    model = current_directory()
+    resolved = _resolve_groups(groups, model)
+    member_sets = [set(g.members) for g in resolved]
+    pairs = []
+    for i in range(len(resolved)):
+        for j in range(i + 1, len(resolved)):
+            shared = len(member_sets[i] & member_sets[j])
+            union = len(member_sets[i]) + len(member_sets[j]) - shared
+            pairs.append({
+                "a": resolved[i].cn, "b": resolved[j].cn, "shared": shared,
+                "jaccard": round(shared / union, 4) if union else 0.0,
+            })
+    pairs.sort(key=lambda p: p["shared"], reverse=True)
+    return {
+        "sizes": {g.cn: len(g.members) for g in resolved},
+        "all_shared": len(model.intersection(*(g.members for g in resolved))) if resolved else 0,
+        "pairs": pairs,
+    }
+
+@app.get("/api/analytics/groups")
+def group_analytics(
+    limit: int = Query(50, ge=1, le=1000),
+    admin: str = Depends(validate_admin)
+):
+    """Largest groups, empty groups and orphaned groups (only members that aren't existing users)."""
+    model = current_directory()
+    all_groups = model.groups()
+    return {
+        "groups": len(all_groups),
+        "largest": [_group_summary(g) for g in sorted(all_groups, key=lambda g: len(g.members), reverse=True)[:limit]],
+        "empty": [_group_summary(g) for g in all_groups if not g.members and not g.external],
+        "orphaned": [_group_summary(g) for g in all_groups if not g.members and g.external],
+    }
+
+@app.get("/api/analytics/users/without-groups")
+def users_without_groups(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    admin: str = Depends(validate_admin)
+):
+    model = current_directory()
+    in_any_group = model.union(*(g.members for g in model.groups()))
+    return _page_of_users(model, model.difference(model.alive_rows(), in_any_group), offset, limit)
+
+# --- STARTUP WARM-UP AND PROBES ---
+# /healthz: the process is alive. /readyz: LDAP answers and the startup caches are warm.
+LDAP_POOL_WARM = int(os.getenv("LDAP_POOL_WARM", "4"))
+READY_PROBE_INTERVAL = float(os.getenv("READY_PROBE_INTERVAL", "5"))
+READY_PROBE_TIMEOUT = float(os.getenv("READY_PROBE_TIMEOUT", "3"))
+_probe_conn = None
+
+def probe_ldap():
+    """Base-scope read on a dedicated connection, so a busy pool can't fail the probe."""
+    global _probe_conn
+    try:
+        if _probe_conn is None or _probe_conn.closed:
+            _probe_conn = InstrumentedConnection(get_ldap_server(), user=ADMIN_DN, password=ADMIN_PW,
+                                                 auto_bind=True, receive_timeout=READY_PROBE_TIMEOUT)
+        if not _probe_conn.search(BASE_DN, '(objectClass=*)', search_scope=BASE, attributes=['1.1']):
+            raise LDAPException(f"Base entry not readable: {_probe_conn.result.get('description')}")
+    except Exception:
+        conn, _probe_conn = _probe_conn, None
+        if conn is not None:
+            try:
+                conn.unbind()
+            except Exception:
+                pass
+        raise
+
+def warm_pool():
+    # Opening the first connection also reads the root DSE and schema into the shared Server
+    conns = []
+    try:
+        for _ in range(max(1, min(LDAP_POOL_WARM, ldap_pool.max_size))):
+            conns.append(ldap_pool.acquire())
+    finally:
+        for conn in conns:
+            ldap_pool.release(conn)
+    if get_ldap_server().schema is None:
+        print("Warm-up: server schema unavailable; searches will not be schema-checked")
+
+def warm_admins():
+    with get_conn() as conn:
+        print(f"Warm-up: cached {prime_admin_cache(conn)} admins")
+
+def warm_directory():
+    if not load_directory(prefer_snapshot=True):
+        raise RuntimeError("directory model did not load")
+
+warmup = Warmup(
+    [
+        WarmupStep("pool", warm_pool),
+        WarmupStep("tree", prime_tree_cache),
+        WarmupStep("admins", warm_admins),
+        # Only the analytics endpoints need the model; they answer 503 until it is loaded
+        WarmupStep("directory", warm_directory, required=False),
+    ],
+    probe=probe_ldap,
+    probe_interval=READY_PROBE_INTERVAL,
+)
+
+@app.on_event("startup")
+def start_warmup():
+    if IS_CONFIGURED:
+        warmup.start()
+
+@app.on_event("shutdown")
+def stop_warmup():
+    warmup.stop()
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: answers as long as the event loop does; never touches LDAP."""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """Readiness: 503 until LDAP is reachable and the warm-up steps have finished."""
+    if not IS_CONFIGURED:
+        return JSONResponse(status_code=503, content={"status": "unconfigured",
+                                                      "detail": "BASE_DN, ADMIN_USER, or ADMIN_PW is missing"})
+    ready, report = warmup.report()
+    report["pool"] = ldap_pool.stats()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
@@ -0,0 +1,229 @@
+import threading
+import time
+
+# --- PROMETHEUS TEXT EXPOSITION ---
+# A tiny, dependency-free registry that renders the Prometheus text format (0.0.4).
+# Everything is guarded by one lock because sync routes (e.g. /api/tree) run in
+# FastAPI's threadpool while async routes run on the event loop.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self):
+        with _lock:
+            return [(_format_labels(self.labelnames, k), v) for k, v in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Read the value lazily at scrape time (pool sizes, cache sizes...)."""
+        self._callbacks[self._key(labels)] = fn
+
+    def _samples(self):
+        samples = super()._samples()
+        for key, fn in list(self._callbacks.items()):
+            try:
+                samples.append((_format_labels(self.labelnames, key), fn()))
+            except Exception as e:
+                print(f"Metrics callback error for {self.name}: {e}")
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, state in items:
+            for i, bound in enumerate(self.buckets):
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {state[i]}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- APPLICATION METRICS ---
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route template, method and status code.",
+    ["route", "method", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template and method.",
+    ["route", "method"])
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.")
+
+LDAP_OP_LATENCY = Histogram(
+    "ldap_operation_duration_seconds", "LDAP operation latency by operation type and result code.",
+    ["operation", "result"])
+LDAP_CONNECTIONS_OPENED = Counter(
+    "ldap_connections_opened_total", "LDAP socket connections opened.")
+LDAP_BINDS = Counter(
+    "ldap_binds_total", "LDAP bind attempts by outcome.", ["result"])
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups by cache name and result (hit/miss).", ["cache", "result"])
+
+PAGING_SESSIONS_OPEN = Gauge(
+    "ldap_paging_sessions_open",
+    "Paged result sets whose last cookie was handed out less than PAGING_SESSION_TTL seconds ago.")
+
+PAGING_SESSION_TTL = 300.0  # a cookie not followed up within this long counts as abandoned
+_paging_cookies = {}        # cookie handed out -> monotonic time
+
+LOGIN_ATTEMPTS = Counter(
+    "login_attempts_total", "Login attempts by outcome.", ["result"])
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def track_paging(cookie_in, cookie_out):
+    """
+    A paging session is open while its latest cookie is outstanding: it closes when the server
+    stops returning one, or ages out after PAGING_SESSION_TTL if the client never comes back.
+    """
+    now = time.monotonic()
+    with _lock:
+        if cookie_in:
+            _paging_cookies.pop(cookie_in, None)
+        if cookie_out:
+            _paging_cookies[cookie_out] = now
+            if len(_paging_cookies) > 10000:
+                _expire_paging_cookies(now)
+
+
+def _expire_paging_cookies(now):
+    for cookie in [c for c, at in _paging_cookies.items() if now - at > PAGING_SESSION_TTL]:
+        del _paging_cookies[cookie]
+
+
+def _open_paging_sessions():
+    with _lock:
+        _expire_paging_cookies(time.monotonic())
+        return len(_paging_cookies)
+
+
+PAGING_SESSIONS_OPEN.set_function(_open_paging_sessions)
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+
+from ldap3.core.exceptions import LDAPException
+
+from backend import metrics
+
+# --- LDAP CONNECTION POOL ---
+# Admin-bound connections are expensive to set up (TCP + TLS + bind + schema read), so they
+# are kept and reused across requests. Idle connections are handed out LIFO so the hot ones
+# stay hot and the cold ones age out before slapd's idletimeout closes them under us.
+
+POOL_SIZE = metrics.Gauge(
+    "ldap_pool_size", "Connections currently owned by the LDAP pool (idle + leased).")
+POOL_IN_USE = metrics.Gauge(
+    "ldap_pool_connections_in_use", "Pooled LDAP connections currently leased.")
+POOL_MAX_SIZE = metrics.Gauge(
+    "ldap_pool_max_size", "Configured maximum size of the LDAP connection pool.")
+POOL_WAIT = metrics.Histogram(
+    "ldap_pool_wait_seconds", "Time spent waiting to lease a pooled connection.")
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, factory, max_size=20, acquire_timeout=10.0, max_idle=60.0):
+        self.factory = factory
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self._idle = deque()  # (conn, returned_at)
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        POOL_MAX_SIZE.set(max_size)
+        POOL_SIZE.set_function(lambda: self._size)
+        POOL_IN_USE.set_function(lambda: self._in_use)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "in_use": self._in_use, "idle": len(self._idle), "max_size": self.max_size}
+
+    def acquire(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.acquire_timeout
+        stale = []
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, returned_at = self._idle.pop()
+                    if conn.closed or not conn.bound or time.monotonic() - returned_at > self.max_idle:
+                        stale.append(conn)
+                        self._size -= 1
+                        continue
+                    self._in_use += 1
+                    break
+                else:
+                    conn = None
+                if conn is not None:
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot now, connect outside the lock
+                    self._size += 1
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"No LDAP connection available within {self.acquire_timeout}s")
+                self._cond.wait(remaining)
+
+        for old in stale:
+            self._close(old)
+
+        if conn is None:
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        POOL_WAIT.observe(time.perf_counter() - start)
+        return conn
+
+    def release(self, conn, broken=False):
+        discard = broken or conn.closed or not conn.bound
+        if not discard:
+            # Don't keep the last (possibly huge) result set alive while the connection idles
+            conn.response = None
+            conn._entries = []
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close(conn)
+
+    def lease(self):
+        return _Lease(self)
+
+    def close_all(self):
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+
+class _Lease:
+    """`with pool.lease() as conn:` -- a connection that broke at the LDAP layer is not reused."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        broken = exc_type is not None and issubclass(exc_type, LDAPException)
+        self.pool.release(self.conn, broken)
+        return False
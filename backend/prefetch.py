@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import metrics
+
+# --- NEXT-PAGE PREFETCH ---
+# Someone paging through a listing almost always asks for "next page" next. After a page is
+# served, its next cookie is fetched in the background into a small buffer keyed by that
+# cookie, so the follow-up request is answered from memory. The read-ahead depth follows each
+# paging session's observed request interval (one page for slow readers, up to `max_depth`
+# for fast scrollers), the buffer is bounded, stale pages and idle sessions are dropped, and
+# nothing is fetched while `can_fetch()` says LDAP is busy. A cookie is only ever used by one
+# fetch at a time: a request whose page is being prefetched waits for that fetch, never
+# starts a second one. After a write `clear()` drops pages not fetched yet and marks the rest
+# stale; their cookies are spent, so a stale page is re-read with `refresh` when handed out.
+
+PREFETCH_PAGES = metrics.Counter(
+    "prefetch_pages_total", "Prefetched listing pages by outcome.", ["kind", "result"])
+PREFETCH_BUFFERED = metrics.Gauge(
+    "prefetch_pages_buffered", "Listing pages currently held in the prefetch buffer.")
+
+
+class _Slot:
+    __slots__ = ("future", "session", "ahead", "created", "next_cookie", "stale")
+
+    def __init__(self, session, ahead):
+        self.future = None
+        self.session = session
+        self.ahead = ahead          # pages to keep buffered beyond this one's predecessor
+        self.created = time.monotonic()
+        self.next_cookie = None
+        self.stale = False          # may predate a write: refreshed before it is handed out
+
+
+class _Session:
+    __slots__ = ("last_seen", "interval")
+
+    def __init__(self):
+        self.last_seen = time.monotonic()
+        self.interval = None        # EWMA of seconds between page requests
+
+
+class Prefetcher:
+    """
+    `fetch(cookie)` (run on a worker thread) returns a page dict with a "next_cookie" key;
+    pages are keyed by (kind, page_size, cookie) and handed out at most once. `refresh(kind,
+    page)` (blocking) returns an up-to-date copy of a page that went stale.
+    """
+
+    def __init__(self, workers=2, max_pages=200, ttl=30.0, max_depth=3, horizon=3.0,
+                 max_page_size=200, can_fetch=None, refresh=None):
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.max_depth = max_depth
+        self.horizon = horizon      # seconds of reading to keep buffered ahead of the client
+        self.max_page_size = max_page_size
+        self.can_fetch = can_fetch or (lambda: True)
+        self.refresh = refresh
+        self.enabled = workers > 0 and max_pages > 0
+        self._executor = ThreadPoolExecutor(max(1, workers), thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._slots = {}            # (kind, page_size, cookie) -> _Slot
+        self._sessions = {}         # session id -> _Session
+        self._session_ids = itertools.count(1)
+        PREFETCH_BUFFERED.set_function(lambda: len(self._slots))
+
+    def stop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def clear(self):
+        """
+        The directory changed: queued fetches are cancelled and dropped (their cookies are
+        unused, the request fetches the page itself), pages fetched or being fetched are
+        marked stale. Without `refresh` those are dropped too once fetched.
+        """
+        with self._lock:
+            for key, slot in list(self._slots.items()):
+                if slot.future is None or slot.future.cancel():
+                    del self._slots[key]
+                else:
+                    slot.stale = True
+
+    async def take(self, kind, page_size, cookie):
+        """
+        The buffered page for `cookie` (waiting for a prefetch that is already running) and its
+        session id, or (None, session id) if the caller has to fetch it itself. A prefetch still
+        queued behind other work is cancelled instead of awaited.
+        """
+        if not self.enabled:
+            return None, None
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            slot = self._slots.pop((kind, page_size, cookie), None) if cookie else None
+            session = self._touch(slot.session if slot else None, now)
+        if slot is None or slot.future is None:
+            return None, session
+        if slot.future.cancel():
+            # Still queued: the workers are busy, so fetching inline is quicker than waiting
+            PREFETCH_PAGES.inc(kind=kind, result="queued")
+            return None, session
+        try:
+            # No timeout: fetching inline now would send the cookie the running fetch is using
+            page = await asyncio.wrap_future(slot.future)
+        except Exception:
+            PREFETCH_PAGES.inc(kind=kind, result="miss")
+            return None, session
+        if page is None:
+            PREFETCH_PAGES.inc(kind=kind, result="miss")
+            return None, session
+        if slot.stale:
+            if self.refresh is None:
+                PREFETCH_PAGES.inc(kind=kind, result="stale")
+                return None, session
+            page = await asyncio.get_running_loop().run_in_executor(None, self.refresh, kind, page)
+            PREFETCH_PAGES.inc(kind=kind, result="refreshed")
+            return page, session
+        PREFETCH_PAGES.inc(kind=kind, result="hit")
+        return page, session
+
+    def after_serve(self, kind, page_size, next_cookie, fetch, session):
+        """Called once a page went out: keep the session's read-ahead filled from `next_cookie`."""
+        if not self.enabled or not next_cookie or session is None or page_size > self.max_page_size:
+            return
+        with self._lock:
+            state = self._sessions.get(session)
+            depth = self._depth(state)
+        self._ensure(kind, page_size, next_cookie, fetch, session, depth)
+
+    # --- internals ---
+    def _touch(self, session, now):
+        state = self._sessions.get(session) if session else None
+        if state is None:
+            session = next(self._session_ids)
+            self._sessions[session] = _Session()
+            return session
+        gap = now - state.last_seen
+        state.interval = gap if state.interval is None else 0.5 * state.interval + 0.5 * gap
+        state.last_seen = now
+        return session
+
+    def _depth(self, state):
+        if state is None or not state.interval:
+            return 1
+        return max(1, min(self.max_depth, int(self.horizon / state.interval)))
+
+    def _sweep(self, now):
+        for key in [k for k, s in self._slots.items() if now - s.created > self.ttl]:
+            slot = self._slots.pop(key)
+            if slot.future is not None:
+                slot.future.cancel()
+            PREFETCH_PAGES.inc(kind=key[0], result="expired")
+        for sid in [sid for sid, st in self._sessions.items() if now - st.last_seen > self.ttl]:
+            del self._sessions[sid]
+
+    def _ensure(self, kind, page_size, cookie, fetch, session, ahead):
+        key = (kind, page_size, cookie)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                slot.ahead = max(slot.ahead, ahead)
+                follow = slot.next_cookie if slot.future and slot.future.done() else None
+            else:
+                follow = None
+                if len(self._slots) >= self.max_pages or not self.can_fetch():
+                    PREFETCH_PAGES.inc(kind=kind, result="skipped")
+                    return
+                slot = self._slots[key] = _Slot(session, ahead)
+                slot.future = self._executor.submit(self._run, kind, key, slot, fetch)
+        if follow and ahead > 1:
+            self._ensure(kind, page_size, follow, fetch, session, ahead - 1)
+
+    def _run(self, kind, key, slot, fetch):
+        with self._lock:
+            state = self._sessions.get(slot.session)
+            if state is None or time.monotonic() - state.last_seen > self.ttl:
+                # The reader went away before we got to it
+                if self._slots.get(key) is slot:
+                    del self._slots[key]
+                PREFETCH_PAGES.inc(kind=kind, result="cancelled")
+                return None
+        try:
+            page = fetch(key[2])
+        except Exception as e:
+            print(f"Prefetch of {kind} page failed: {e}")
+            with self._lock:
+                if self._slots.get(key) is slot:
+                    del self._slots[key]
+            PREFETCH_PAGES.inc(kind=kind, result="error")
+            return None
+        PREFETCH_PAGES.inc(kind=kind, result="fetched")
+        slot.next_cookie = page.get("next_cookie")
+        if slot.ahead > 1 and slot.next_cookie:
+            self._ensure(kind, key[1], slot.next_cookie, fetch, slot.session, slot.ahead - 1)
+        return page
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from backend import metrics
+
+# --- STARTUP WARM-UP ---
+# Right after a (re)start the first requests used to pay every cold cost at once: opening
+# LDAP connections, reading the root DSE and schema, the first full tree scan, the first
+# admin lookups. The warm-up runs those steps once in a background thread, in order, retrying
+# with backoff while LDAP is unreachable. /readyz reports ready only after every required step
+# has succeeded and LDAP still answers, so traffic is held back until the caches are hot.
+
+BACKEND_READY = metrics.Gauge(
+    "backend_ready", "1 once warm-up has finished and the last LDAP readiness probe succeeded.")
+WARMUP_STEP_SECONDS = metrics.Gauge(
+    "warmup_step_seconds", "Duration of the last successful run of each warm-up step.", ["step"])
+
+
+class WarmupStep:
+    """`run()` does the work and raises on failure; optional steps don't gate readiness."""
+
+    def __init__(self, name, run, required=True):
+        self.name = name
+        self.run = run
+        self.required = required
+        self.status = "pending"
+        self.error = None
+        self.seconds = None
+
+
+class Warmup:
+    def __init__(self, steps, probe, probe_interval=5.0, retry_max=60.0):
+        self.steps = steps
+        self.probe = probe  # () -> None, raises if LDAP doesn't answer
+        self.probe_interval = probe_interval
+        self.retry_max = retry_max
+        self.started_at = None
+        self.finished_at = None
+        self._last_probe = (0.0, None)  # (monotonic time, error or None)
+        self._probe_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        BACKEND_READY.set_function(lambda: 1 if self.warm and self._last_probe[1] is None else 0)
+
+    @property
+    def warm(self):
+        return all(s.status == "done" for s in self.steps if s.required)
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        for step in self.steps:
+            backoff = 1.0
+            while not self._stop.is_set():
+                step.status = "running"
+                started = time.perf_counter()
+                try:
+                    step.run()
+                except Exception as e:
+                    step.status, step.error = "failed", str(e)
+                    if not step.required:
+                        print(f"Warm-up step '{step.name}' failed (optional, skipped): {e}")
+                        break
+                    print(f"Warm-up step '{step.name}' failed (retrying in {backoff:.0f}s): {e}")
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, self.retry_max)
+                    continue
+                step.status, step.error = "done", None
+                step.seconds = round(time.perf_counter() - started, 3)
+                WARMUP_STEP_SECONDS.set(step.seconds, step=step.name)
+                break
+        self.finished_at = time.time()
+        print(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s")
+
+    def check_ldap(self):
+        """Result of the LDAP probe, re-run at most once per `probe_interval` seconds."""
+        with self._probe_lock:
+            checked_at, error = self._last_probe
+            if time.monotonic() - checked_at >= self.probe_interval:
+                try:
+                    self.probe()
+                    error = None
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                self._last_probe = (time.monotonic(), error)
+            return error
+
+    def report(self):
+        ldap_error = self.check_ldap()
+        ready = self.warm and ldap_error is None
+        return ready, {
+            "status": "ready" if ready else "starting" if ldap_error is None else "unavailable",
+            "ldap": {"ok": ldap_error is None, "error": ldap_error},
+            "steps": [{"name": s.name, "status": s.status, "required": s.required,
+                       "seconds": s.seconds, "error": s.error} for s in self.steps],
+        }